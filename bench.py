@@ -0,0 +1,219 @@
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+os.environ.setdefault("BOT_TOKEN", "123456789:bench-placeholder-token")
+os.environ.setdefault("ADMIN_CHAT_ID", "1")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+START_DIR = os.getcwd()
+BENCH_DIR = tempfile.mkdtemp(prefix="attendance_bench_")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(BENCH_DIR)
+
+import bot
+from openpyxl import load_workbook
+
+FIRST_USER_ID = 100000
+REASONS = ["болею", "семейные обстоятельства", "соревнования", "к врачу", None]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарк хранилища attendance_bot на синтетических данных")
+    parser.add_argument("--users", type=int, default=200, help="число студентов")
+    parser.add_argument("--days", type=int, default=120, help="число прошедших учебных дней в журнале")
+    parser.add_argument("--density", type=float, default=0.05, help="доля отметок «не буду» (0..1)")
+    parser.add_argument("--periods", type=float, default=0.1, help="доля студентов с периодом отсутствия")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов для операций с Excel-журналом")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="сохранить результаты в JSON для сравнения")
+    parser.add_argument("--baseline", help="JSON с прошлым прогоном для сравнения")
+    parser.add_argument("--keep", action="store_true", help="не удалять каталог со сгенерированными данными")
+    return parser.parse_args()
+
+def generate(users: int, days: int, density: float, periods: float, seed: int) -> dict:
+    rng = random.Random(seed)
+    today = datetime.now(bot.TIMEZONE).date()
+    school_days = bot.get_date_range(today - timedelta(days=days * 2 + 14), today)[-days:]
+
+    bot.init_db()
+    user_rows = [(FIRST_USER_ID + index, f"Студент {index + 1}", f"student_{index + 1}") for index in range(users)]
+    marks = {}
+    absences = []
+    for user_id, _, _ in user_rows:
+        for date_str in school_days:
+            if rng.random() < density:
+                reason = rng.choice(REASONS)
+                marks[(user_id, date_str)] = ("❌", reason)
+                absences.append((user_id, date_str, reason))
+            else:
+                marks[(user_id, date_str)] = ("✅", None)
+
+    absence_periods = []
+    for user_id, _, _ in rng.sample(user_rows, int(users * periods)):
+        start = rng.randrange(len(school_days))
+        end = min(start + rng.randint(2, 6), len(school_days) - 1)
+        absence_periods.append((user_id, school_days[start], school_days[end], rng.choice(REASONS)))
+
+    conn = bot.connect_db()
+    cursor = conn.cursor()
+    cursor.executemany("INSERT INTO users (user_id, name, username) VALUES (?, ?, ?)", user_rows)
+    cursor.executemany("INSERT INTO absences (user_id, date, reason) VALUES (?, ?, ?)", absences)
+    cursor.executemany(
+        "INSERT INTO absence_periods (user_id, start_date, end_date, reason) VALUES (?, ?, ?, ?)",
+        absence_periods
+    )
+    cursor.executemany(
+        "INSERT INTO marks (user_id, date, status, reason) VALUES (?, ?, ?, ?)",
+        [(user_id, date_str, status, reason) for (user_id, date_str), (status, reason) in marks.items()]
+    )
+    conn.commit()
+    conn.close()
+    bot.init_event_log()
+    bot.school_calendar.load_holidays()
+    bot.attendance_matrix.load()
+
+    bot.init_excel()
+    wb = load_workbook(bot.journal_file())
+    first_day = bot.as_date(school_days[0])
+    bot.ensure_dates_in_excel(wb.active, first_day, (today - first_day).days + 1)
+    wb.save(bot.journal_file())
+    bot.ensure_users_in_excel(user_rows)
+    wb = load_workbook(bot.journal_file())
+    bot.apply_marks_to_journal(wb.active, marks)
+    wb.save(bot.journal_file())
+
+    return {"users": user_rows, "school_days": school_days, "marks": marks, "rng": rng}
+
+def operations(data: dict, repeat: int) -> list:
+    users = data["users"]
+    school_days = data["school_days"]
+    rng = data["rng"]
+    first_day = bot.as_date(school_days[0])
+    last_day = bot.as_date(school_days[-1])
+    journal = io.BytesIO()
+    load_workbook(bot.journal_file()).save(journal)
+    ahead_dates = bot.get_weekdays(datetime.now(), 30)
+    marks = {key: status for key, (status, _) in data["marks"].items()}
+
+    def pick_user():
+        return rng.choice(users)
+
+    def prepare_ensure_dates():
+        ws = load_workbook(io.BytesIO(journal.getvalue())).active
+        dropped = {ahead_dates[0], ahead_dates[len(ahead_dates) // 2], ahead_dates[-1]}
+        for col in range(ws.max_column, 3, -1):
+            if str(ws.cell(row=1, column=col).value) in dropped:
+                ws.delete_cols(col)
+        return (ws,)
+    
+    def run_ensure_dates(ws):
+        bot.ensure_dates_in_excel(ws, datetime.now(), 30)
+
+    def run_ensure_user():
+        user_id, name, username = pick_user()
+        bot.ensure_user_in_excel(user_id, name, username)
+
+    def run_update_attendance():
+        key = (pick_user()[0], rng.choice(school_days[-10:]))
+        marks[key] = "✅" if marks.get(key) == "❌" else "❌"
+        bot.update_attendance_in_excel(*key, marks[key])
+
+    def run_is_user_absent():
+        bot.is_user_absent_today(pick_user()[0], rng.choice(school_days))
+
+    def run_date_range():
+        bot.get_date_range(first_day, last_day)
+
+    return [
+        ("get_date_range", run_date_range, repeat * 100, None),
+        ("is_user_absent_today", run_is_user_absent, repeat * 100, None),
+        ("ensure_dates_in_excel", run_ensure_dates, repeat * 10, prepare_ensure_dates),
+        ("ensure_user_in_excel", run_ensure_user, repeat, None),
+        ("update_attendance_in_excel", run_update_attendance, repeat, None),
+        ("journal_build", bot.build_journal, repeat, None),
+    ]
+
+def measure(func, runs: int, setup=None) -> dict:
+    prepare = setup or tuple
+    func(*prepare())
+    timings = []
+    for _ in range(runs):
+        args = prepare()
+        started = time.perf_counter()
+        func(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    
+    args = prepare()
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "runs": runs,
+        "mean_ms": statistics.fmean(timings),
+        "median_ms": statistics.median(timings),
+        "min_ms": min(timings),
+        "peak_kb": peak / 1024,
+    }
+
+def format_delta(value: float, baseline: float) -> str:
+    if not baseline:
+        return ""
+    return f"{(value - baseline) / baseline * 100:+.1f}%"
+
+def main():
+    args = parse_args()
+    started = time.perf_counter()
+    data = generate(args.users, args.days, args.density, args.periods, args.seed)
+    generated_in = time.perf_counter() - started
+
+    baseline = {}
+    if args.baseline:
+        with open(os.path.join(START_DIR, args.baseline), encoding="utf-8") as file:
+            baseline = json.load(file)["results"]
+
+    print(f"📊 attendance_bot storage benchmark ({BENCH_DIR})")
+    print(
+        f"users={args.users} school_days={args.days} density={args.density} "
+        f"periods={args.periods} seed={args.seed} repeat={args.repeat}"
+    )
+    print(
+        f"db: {os.path.getsize('attendance.db') // 1024} KB, "
+        f"journal: {os.path.getsize(bot.journal_file()) // 1024} KB, "
+        f"generated in {generated_in:.1f} s\n"
+    )
+    header = f"{'operation':<28}{'runs':>6}{'mean ms':>12}{'median ms':>12}{'min ms':>12}{'peak KB':>12}"
+    print(header + ("  Δ median" if baseline else ""))
+
+    results = {}
+    for name, func, runs, setup in operations(data, args.repeat):
+        result = measure(func, runs, setup)
+        results[name] = result
+        line = (
+            f"{name:<28}{result['runs']:>6}{result['mean_ms']:>12.3f}{result['median_ms']:>12.3f}"
+            f"{result['min_ms']:>12.3f}{result['peak_kb']:>12.1f}"
+        )
+        if name in baseline:
+            line += f"  {format_delta(result['median_ms'], baseline[name]['median_ms'])}"
+        print(line)
+
+    if args.save:
+        params = {key: value for key, value in vars(args).items() if key not in ("save", "baseline", "keep")}
+        with open(os.path.join(START_DIR, args.save), "w", encoding="utf-8") as file:
+            json.dump({"params": params, "results": results}, file, ensure_ascii=False, indent=2)
+
+    if not args.keep:
+        os.chdir(START_DIR)
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
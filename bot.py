@@ -1,10 +1,24 @@
 import asyncio
+import collections
+import contextvars
+import csv
+import io
+import json
+import logging
+import logging.handlers
+import queue
 import sqlite3
 import re
 import os
-from datetime import datetime, timedelta
+import secrets
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
 
+import numpy as np
 import pandas as pd
 from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, PatternFill, Alignment
@@ -12,19 +26,29 @@ from openpyxl.utils import get_column_letter
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from zoneinfo import ZoneInfo
 
-from aiogram import Bot, Dispatcher, Router
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, FSInputFile
-from aiogram.filters import Command, StateFilter
+from aiogram import Bot, Dispatcher, Router, BaseMiddleware
+from aiogram.types import (
+    Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove,
+    InlineKeyboardMarkup, InlineKeyboardButton, BufferedInputFile, TelegramObject
+)
+from aiogram.filters import Command, CommandObject, StateFilter
+from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter, TelegramAPIError
 
 EXCEL_FILE = "attendance_journal.xlsx"
+GROUPS_DB = "groups.db"
+GROUPS_DIR = "groups"
+DEFAULT_GROUP_ID = "main"
 load_dotenv()
 
+logger = logging.getLogger("attendance_bot")
+
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_CHAT_ID_RAW = os.getenv("ADMIN_CHAT_ID")
 
@@ -38,11 +62,93 @@ try:
 except ValueError:
     raise ValueError(f"❌ ОШИБКА: ADMIN_CHAT_ID должен быть числом, получено: '{ADMIN_CHAT_ID_RAW}'")
 
+TIMEZONE = ZoneInfo("Europe/Moscow")
+DEFAULT_REMINDER_TIME = "20:00"
+REMINDER_EARLIEST = "16:00"
+FOLLOWUP_DELAY_MINUTES = int(os.getenv("FOLLOWUP_DELAY_MINUTES", "90"))
+FOLLOWUP_LATEST = os.getenv("FOLLOWUP_LATEST", "23:00")
+CALENDAR_WINDOW_DAYS = 400
+DIGEST_INTERVAL_MINUTES = int(os.getenv("DIGEST_INTERVAL_MINUTES", "5"))
+DIGEST_MAX_EVENTS = int(os.getenv("DIGEST_MAX_EVENTS", "20"))
+TELEGRAM_MESSAGE_LIMIT = 4096
+SNAPSHOT_EVERY_EVENTS = int(os.getenv("SNAPSHOT_EVERY_EVENTS", "500"))
+ROSTER_MAX_BYTES = 1024 * 1024
+FUZZY_MATCH_THRESHOLD = 0.6
+ROSTER_COLUMNS = {
+    "user_id": {"user_id", "id", "telegram_id", "айди"},
+    "name": {"name", "имя", "фио"},
+    "username": {"username", "юзернейм", "ник"},
+}
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = int(os.getenv("LOG_SAMPLE_RATE", "20"))
+SLOW_HANDLER_MS = float(os.getenv("SLOW_HANDLER_MS", "1000"))
+WEEKDAY_NAMES_ACC = ["понедельник", "вторник", "среду", "четверг", "пятницу", "субботу", "воскресенье"]
+
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "1"))
+THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", "3"))
+MARK_CACHE_SIZE = int(os.getenv("MARK_CACHE_SIZE", "20000"))
+
+TASK_MAX_RUNNING = int(os.getenv("TASK_MAX_RUNNING", "4"))
+TASK_CONCURRENCY = {"interactive": 4, "notifications": 2, "reports": 1, "maintenance": 1}
+JOURNAL_MAINTENANCE_TIME = os.getenv("JOURNAL_MAINTENANCE_TIME", "03:30")
+DB_MAINTENANCE_TIME = os.getenv("DB_MAINTENANCE_TIME", "04:00")
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "730"))
+RETENTION_TABLES = {"absences": "date", "absence_periods": "end_date", "reminder_log": "target_date"}
+MAINTENANCE_BATCH_ROWS = 500
+MAINTENANCE_STEP_SECONDS = 0.05
+VACUUM_STEP_PAGES = 256
+
 bot = Bot(token=BOT_TOKEN)
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 router = Router()
 
+class StructuredFormatter(logging.Formatter):
+    fields = ("handler", "group", "user_id", "duration_ms")
+    
+    def format(self, record: logging.LogRecord) -> str:
+        extras = [
+            f"{field}={getattr(record, field)}"
+            for field in self.fields
+            if getattr(record, field, None) is not None
+        ]
+        record.structured = f" [{' '.join(extras)}]" if extras else ""
+        return super().format(record)
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: int = LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+        self.counters: dict[tuple, int] = {}
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        sampled = getattr(record, "sampled", False) or (
+            record.name == "aiogram.event" and record.levelno == logging.INFO
+        )
+        if not sampled or self.rate <= 1:
+            return True
+        
+        key = (record.pathname, record.lineno)
+        count = self.counters.get(key, 0)
+        self.counters[key] = count + 1
+        return count % self.rate == 0
+
+def setup_logging() -> logging.handlers.QueueListener:
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(StructuredFormatter("%(asctime)s %(levelname)s %(name)s%(structured)s: %(message)s"))
+    
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter())
+    
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.handlers = [queue_handler]
+    
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
 class AttendanceForm(StatesGroup):
     waiting_for_name = State()
     waiting_for_attendance = State()
@@ -53,15 +159,748 @@ class AttendanceForm(StatesGroup):
     waiting_for_absence_reason = State()
     waiting_for_duty_usernames = State()
     waiting_for_new_name = State()
+    waiting_for_reminder_time = State()
+    waiting_for_roster = State()
+    waiting_for_roster_confirm = State()
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, rate: float = THROTTLE_RATE, burst: int = THROTTLE_BURST, max_buckets: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_buckets = max_buckets
+        self.buckets: dict[int, tuple[float, float]] = {}
+        self.warned: set[int] = set()
+    
+    def _prune(self, now: float):
+        refill_time = self.burst / self.rate
+        self.buckets = {
+            user_id: bucket for user_id, bucket in self.buckets.items()
+            if now - bucket[1] < refill_time
+        }
+        self.warned &= self.buckets.keys()
+    
+    def _take_token(self, user_id: int) -> bool:
+        now = time.monotonic()
+        if len(self.buckets) > self.max_buckets:
+            self._prune(now)
+        tokens, updated = self.buckets.get(user_id, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self.buckets[user_id] = (tokens, now)
+            return False
+        self.buckets[user_id] = (tokens - 1, now)
+        return True
+    
+    async def __call__(self, handler, event: TelegramObject, data: dict):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        
+        if self._take_token(user.id):
+            self.warned.discard(user.id)
+            return await handler(event, data)
+        
+        if user.id not in self.warned:
+            self.warned.add(user.id)
+            if isinstance(event, Message):
+                await event.answer("⏳ Слишком часто! Подожди пару секунд.")
+        if isinstance(event, CallbackQuery):
+            await event.answer("⏳ Слишком часто! Подожди пару секунд.")
+        return None
+
+class LoggingMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event: TelegramObject, data: dict):
+        handler_object = data.get("handler")
+        handler_name = getattr(getattr(handler_object, "callback", None), "__name__", type(event).__name__)
+        user = data.get("event_from_user")
+        extra = {"handler": handler_name, "group": current_group().group_id, "user_id": user.id if user else None}
+        started = time.perf_counter()
+        try:
+            result = await handler(event, data)
+        except Exception:
+            extra["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            logger.exception("❌ Ошибка в обработчике", extra=extra)
+            raise
+        
+        extra["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        if extra["duration_ms"] >= SLOW_HANDLER_MS:
+            logger.warning("⚠️ Медленный обработчик", extra=extra)
+        else:
+            logger.info("✅ Обработано", extra={**extra, "sampled": True})
+        return result
+
+class GroupMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event: TelegramObject, data: dict):
+        user = data.get("event_from_user")
+        group = group_registry.group_for_user(user.id) if user else group_registry.default
+        with group_context(group):
+            return await handler(event, data)
+
+class MarkCallback(CallbackData, prefix="mark"):
+    action: str
+    date: str
+
+class RosterCallback(CallbackData, prefix="roster"):
+    action: str
+
+class AdminDigest:
+    def __init__(self, chat_id: int, max_events: int = DIGEST_MAX_EVENTS, batching: bool = DIGEST_INTERVAL_MINUTES > 0):
+        self.chat_id = chat_id
+        self.max_events = max_events
+        self.batching = batching
+        self.max_queued = max_events * 10
+        self.forbidden = False
+        self.events: list[str] = []
+    
+    async def add(self, text: str, urgent: bool = False):
+        if urgent or not self.batching:
+            await self._send([text])
+            return
+        
+        self.events.append(text)
+        if len(self.events) >= self.max_events:
+            await self.flush()
+    
+    async def flush(self):
+        events, self.events = self.events, []
+        if not events:
+            return
+        
+        header = f"📬 Сводка: {len(events)} событий\n\n"
+        event_limit = TELEGRAM_MESSAGE_LIMIT - len(header)
+        chunks = []
+        current, current_events = header, []
+        for text in events:
+            if len(text) > event_limit:
+                text = text[:event_limit - 1] + "…"
+            if current_events and len(current) + len(text) + 2 > TELEGRAM_MESSAGE_LIMIT:
+                chunks.append((current.rstrip(), current_events))
+                current, current_events = "", []
+            current += text + "\n\n"
+            current_events.append(text)
+        chunks.append((current.rstrip(), current_events))
+        
+        sent = await self._send([chunk for chunk, _ in chunks])
+        if sent == len(chunks):
+            return
+        
+        unsent = [text for _, chunk_events in chunks[sent:] for text in chunk_events]
+        if self.forbidden:
+            logger.warning("⚠️ Админ %s недоступен, сводка из %s событий отброшена", self.chat_id, len(unsent))
+            return
+        self.events[:0] = unsent
+        dropped = len(self.events) - self.max_queued
+        if dropped > 0:
+            del self.events[:dropped]
+        logger.warning(
+            "⚠️ Сводка для админа не доставлена, %s событий вернулись в очередь (отброшено %s)",
+            len(unsent), max(dropped, 0)
+        )
+    
+    async def _send_one(self, text: str):
+        try:
+            await bot.send_message(self.chat_id, text)
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            await bot.send_message(self.chat_id, text)
+    
+    async def _send(self, texts: list) -> int:
+        self.forbidden = False
+        sent = 0
+        for text in texts:
+            try:
+                await self._send_one(text)
+            except TelegramForbiddenError as e:
+                logger.error("❌ Админ %s заблокировал бота: %s", self.chat_id, e)
+                self.forbidden = True
+                return sent
+            except TelegramAPIError as e:
+                logger.error("❌ Ошибка отправки админу: %s", e)
+                return sent
+            sent += 1
+        return sent
+
+class TaskJob:
+    def __init__(self, priority: str, func, args: tuple, key: str, future: asyncio.Future):
+        self.priority = priority
+        self.func = func
+        self.args = args
+        self.key = key
+        self.future = future
+        self.name = key or getattr(func, "__name__", "task")
+        self.context = contextvars.copy_context()
+        self.submitted = time.perf_counter()
+        self.started = False
+
+class TaskQueue:
+    PRIORITIES = ("interactive", "notifications", "reports", "maintenance")
+    
+    def __init__(self, limits: dict = TASK_CONCURRENCY, max_running: int = TASK_MAX_RUNNING):
+        self.limits = limits
+        self.max_running = max_running
+        self.pending = {priority: collections.deque() for priority in self.PRIORITIES}
+        self.running = {priority: 0 for priority in self.PRIORITIES}
+        self.jobs: dict[str, TaskJob] = {}
+        self.tasks: set[asyncio.Task] = set()
+    
+    def submit(self, priority: str, func, *args, key: str = None, supersede: bool = False) -> asyncio.Future:
+        existing = self.jobs.get(key) if key else None
+        if existing is not None:
+            if not supersede:
+                return existing.future
+            if not existing.started:
+                self.pending[existing.priority].remove(existing)
+                existing.future.cancel()
+                logger.info("⏭️ Задача %s заменена более новой", key)
+        
+        job = TaskJob(priority, func, args, key, asyncio.get_running_loop().create_future())
+        job.future.add_done_callback(lambda future: future.cancelled() or future.exception())
+        if key:
+            self.jobs[key] = job
+        self.pending[priority].append(job)
+        self._pump()
+        return job.future
+    
+    async def run(self, priority: str, func, *args, key: str = None, supersede: bool = False):
+        return await asyncio.shield(self.submit(priority, func, *args, key=key, supersede=supersede))
+    
+    def _pump(self):
+        for priority in self.PRIORITIES:
+            queue = self.pending[priority]
+            while queue and self.running[priority] < self.limits[priority]:
+                if priority != "interactive" and sum(self.running.values()) - self.running["interactive"] >= self.max_running:
+                    return
+                job = queue.popleft()
+                job.started = True
+                self.running[priority] += 1
+                task = job.context.run(asyncio.create_task, self._run(job))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+    
+    async def _run(self, job: TaskJob):
+        waited = time.perf_counter() - job.submitted
+        started = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(job.func):
+                result = await job.func(*job.args)
+            else:
+                result = await asyncio.to_thread(job.func, *job.args)
+        except Exception as e:
+            logger.exception("❌ Ошибка фоновой задачи %s: %s", job.name, e)
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self.running[job.priority] -= 1
+            if job.key and self.jobs.get(job.key) is job:
+                del self.jobs[job.key]
+            logger.info(
+                "⚙️ Задача выполнена (%s), ожидание %s мс", job.priority, round(waited * 1000, 1),
+                extra={"handler": job.name, "duration_ms": round((time.perf_counter() - started) * 1000, 1), "sampled": True}
+            )
+            self._pump()
+
+task_queue = TaskQueue()
+
+def as_date(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, "%d.%m.%Y").date()
+
+class SchoolCalendar:
+    def __init__(self, window_days: int = CALENDAR_WINDOW_DAYS):
+        self.window_days = window_days
+        self.version = 0
+        self.holidays: list[tuple] = []
+        self.start: date = None
+        self.end: date = None
+        self.school_days: list[str] = []
+        self.ordinals: dict[str, int] = {}
+        self.next_index: dict[str, int] = {}
+        self.closed_days: dict[str, str] = {}
+    
+    def load_holidays(self):
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT id, start_date, end_date, title FROM holidays
+            ORDER BY {sql_iso_date('start_date')}
+        """)
+        self.holidays = cursor.fetchall()
+        conn.close()
+        
+        today = datetime.now(TIMEZONE).date()
+        lower, upper = calendar_bounds()
+        self.build(
+            max(min(self.start or today, today - timedelta(days=self.window_days)), lower),
+            min(max(self.end or today, today + timedelta(days=self.window_days)), upper)
+        )
+    
+    def build(self, start: date, end: date):
+        closed_days = {}
+        for _, start_str, end_str, title in self.holidays:
+            day, last = as_date(start_str), as_date(end_str)
+            while day <= last:
+                closed_days[day.strftime("%d.%m.%Y")] = title
+                day += timedelta(days=1)
+        
+        school_days = []
+        next_index = {}
+        day = start
+        while day <= end:
+            key = day.strftime("%d.%m.%Y")
+            next_index[key] = len(school_days)
+            if day.weekday() < 6 and key not in closed_days:
+                school_days.append(key)
+            day += timedelta(days=1)
+        
+        self.start, self.end = start, end
+        self.closed_days = closed_days
+        self.school_days = school_days
+        self.next_index = next_index
+        self.ordinals = {day_str: index for index, day_str in enumerate(school_days)}
+        self.version += 1
+    
+    def _cover(self, first: date, last: date) -> bool:
+        lower, upper = calendar_bounds()
+        if first < lower or last > upper or last < first:
+            return False
+        if self.start is not None and self.start <= first and last <= self.end:
+            return True
+        self.build(
+            max(min(first, self.start or first) - timedelta(days=self.window_days), lower),
+            min(max(last, self.end or last) + timedelta(days=self.window_days), upper)
+        )
+        return True
+    
+    def school_days_between(self, start, end) -> list:
+        lower, upper = calendar_bounds()
+        start, end = max(as_date(start), lower), min(as_date(end), upper)
+        if end < start:
+            return []
+        self._cover(start, end)
+        first = self.next_index[start.strftime("%d.%m.%Y")]
+        last = self.next_index.get((end + timedelta(days=1)).strftime("%d.%m.%Y"), len(self.school_days))
+        return self.school_days[first:last]
+    
+    def is_school_day(self, value) -> bool:
+        day = as_date(value)
+        return self._cover(day, day) and day.strftime("%d.%m.%Y") in self.ordinals
+    
+    def next_school_day(self, value) -> str:
+        day = as_date(value) + timedelta(days=1)
+        if not self._cover(day, min(day + timedelta(days=31), calendar_bounds()[1])):
+            return None
+        index = self.next_index[day.strftime("%d.%m.%Y")]
+        if index >= len(self.school_days):
+            return None
+        return self.school_days[index]
+    
+    def ordinal(self, date_str: str) -> int:
+        if not self._cover(as_date(date_str), as_date(date_str)):
+            return None
+        return self.ordinals.get(date_str)
+    
+    def closed_reason(self, date_str: str) -> str:
+        return self.closed_days.get(date_str)
+
+def academic_year_start(value) -> date:
+    day = as_date(value)
+    return date(day.year if day.month >= 9 else day.year - 1, 9, 1)
+
+def calendar_bounds() -> tuple[date, date]:
+    current = academic_year_start(datetime.now(TIMEZONE))
+    return current.replace(year=current.year - 1), current.replace(year=current.year + 2) - timedelta(days=1)
+
+class AttendanceMatrix:
+    NONE, PRESENT, ABSENT = 0, 1, 2
+    STATUS_CODES = {"✅": PRESENT, "❌": ABSENT}
+    
+    def __init__(self):
+        self.user_index: dict[int, int] = {}
+        self.user_ids: list[int] = []
+        self.data = np.zeros((0, 0), dtype=np.uint8)
+        self.calendar_version = None
+        self.lock = threading.RLock()
+    
+    def load(self):
+        with self.lock:
+            self._load()
+    
+    def _load(self):
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("SELECT user_id FROM users ORDER BY user_id")
+        user_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT user_id, start_date, end_date FROM absence_periods")
+        periods = cursor.fetchall()
+        cursor.execute("SELECT user_id, date, status FROM marks")
+        marks = cursor.fetchall()
+        conn.close()
+        
+        self.calendar_version = school_calendar.version
+        self.user_ids = user_ids
+        self.user_index = {user_id: index for index, user_id in enumerate(user_ids)}
+        self.data = np.zeros((max(len(user_ids), 16), len(school_calendar.school_days)), dtype=np.uint8)
+        
+        for user_id, start_date, end_date in periods:
+            try:
+                first_day = max(as_date(start_date), school_calendar.start)
+                last_day = min(as_date(end_date), school_calendar.end)
+            except (TypeError, ValueError):
+                logger.warning("⚠️ Пропущен период отсутствия с некорректными датами: %s–%s", start_date, end_date, extra={"user_id": user_id})
+                continue
+            if last_day < first_day:
+                continue
+            days = school_calendar.school_days_between(first_day, last_day)
+            if days and user_id in self.user_index and self.calendar_version == school_calendar.version:
+                first, last = school_calendar.ordinals[days[0]], school_calendar.ordinals[days[-1]]
+                self.data[self.user_index[user_id], first:last + 1] = self.ABSENT
+        
+        for user_id, date_str, status in marks:
+            ordinal = school_calendar.ordinals.get(date_str)
+            if ordinal is not None and user_id in self.user_index:
+                self.data[self.user_index[user_id], ordinal] = self.STATUS_CODES.get(status, self.NONE)
+        
+        if self.calendar_version != school_calendar.version:
+            self._load()
+            return
+        logger.info(
+            "🧮 Матрица посещаемости: %s пользователей × %s учебных дней, %s КБ",
+            len(user_ids), self.data.shape[1], self.data.nbytes // 1024
+        )
+    
+    def _ordinal(self, date_str: str) -> int:
+        ordinal = school_calendar.ordinal(date_str)
+        if self.calendar_version != school_calendar.version:
+            self._load()
+        return ordinal
+    
+    def _row(self, user_id: int) -> int:
+        row = self.user_index.get(user_id)
+        if row is not None:
+            return row
+        
+        row = len(self.user_ids)
+        if row >= self.data.shape[0]:
+            grown = np.zeros((max(16, self.data.shape[0] * 2), self.data.shape[1]), dtype=np.uint8)
+            grown[:self.data.shape[0]] = self.data
+            self.data = grown
+        self.user_ids.append(user_id)
+        self.user_index[user_id] = row
+        return row
+    
+    def set_mark(self, user_id: int, date_str: str, status: str = None):
+        with self.lock:
+            ordinal = self._ordinal(date_str)
+            if ordinal is None:
+                return
+            row = self._row(user_id)
+            self.data[row, ordinal] = self.STATUS_CODES.get(status, self.NONE)
+    
+    def refresh_period(self, user_id: int, start_date: str, end_date: str):
+        with self.lock:
+            days = school_calendar.school_days_between(start_date, end_date)
+            if self.calendar_version != school_calendar.version:
+                self._load()
+                return
+            if not days:
+                return
+            
+            conn = connect_db()
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT start_date, end_date FROM absence_periods
+                WHERE user_id = ? AND {sql_iso_date('start_date')} <= ? AND {sql_iso_date('end_date')} >= ?
+            """, (user_id, to_iso_key(days[-1]), to_iso_key(days[0])))
+            periods = cursor.fetchall()
+            placeholders = ",".join("?" * len(days))
+            cursor.execute(
+                f"SELECT date, status FROM marks WHERE user_id = ? AND date IN ({placeholders})",
+                [user_id, *days]
+            )
+            marks = cursor.fetchall()
+            conn.close()
+            
+            values = dict.fromkeys(days, self.NONE)
+            for period_start, period_end in periods:
+                for date_str in school_calendar.school_days_between(period_start, period_end):
+                    if date_str in values:
+                        values[date_str] = self.ABSENT
+            for date_str, status in marks:
+                values[date_str] = self.STATUS_CODES.get(status, self.NONE)
+            
+            if self.calendar_version != school_calendar.version:
+                self._load()
+                return
+            row = self._row(user_id)
+            for date_str, value in values.items():
+                self.data[row, school_calendar.ordinals[date_str]] = value
+    
+    def _span(self, start=None, end=None) -> slice:
+        days = school_calendar.school_days_between(start, end) if start and end else None
+        if self.calendar_version != school_calendar.version:
+            self._load()
+        if days is None:
+            return slice(0, self.data.shape[1])
+        if not days:
+            return slice(0, 0)
+        return slice(school_calendar.ordinals[days[0]], school_calendar.ordinals[days[-1]] + 1)
+    
+    def users_with_status(self, date_str: str, status: str) -> list:
+        with self.lock:
+            ordinal = self._ordinal(date_str)
+            if ordinal is None:
+                return []
+            column = self.data[:len(self.user_ids), ordinal]
+            return [self.user_ids[index] for index in np.flatnonzero(column == self.STATUS_CODES[status])]
+    
+    def missed_days(self, user_id: int, start=None, end=None) -> int:
+        with self.lock:
+            span = self._span(start, end)
+            row = self.user_index.get(user_id)
+            if row is None:
+                return 0
+            return int(np.count_nonzero(self.data[row, span] == self.ABSENT))
+    
+    def absence_counts(self, start=None, end=None) -> dict:
+        with self.lock:
+            span = self._span(start, end)
+            counts = np.count_nonzero(self.data[:len(self.user_ids), span] == self.ABSENT, axis=1)
+            return dict(zip(self.user_ids, counts.tolist()))
+    
+    def top_absentees(self, limit: int = 10, start=None, end=None) -> list:
+        with self.lock:
+            span = self._span(start, end)
+            counts = np.count_nonzero(self.data[:len(self.user_ids), span] == self.ABSENT, axis=1)
+            order = np.argsort(-counts, kind="stable")[:limit]
+            return [(self.user_ids[index], int(counts[index])) for index in order if counts[index] > 0]
+    
+    def daily_absent_counts(self, start=None, end=None) -> np.ndarray:
+        with self.lock:
+            span = self._span(start, end)
+            return np.count_nonzero(self.data[:len(self.user_ids), span] == self.ABSENT, axis=0)
+
+class MarkCache:
+    def __init__(self, max_size: int = MARK_CACHE_SIZE):
+        self.max_size = max_size
+        self.items: collections.OrderedDict = collections.OrderedDict()
+        self.lock = threading.Lock()
+    
+    def get(self, key: tuple) -> tuple:
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+    
+    def put(self, key: tuple, value: tuple):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+    
+    def pop(self, key: tuple):
+        with self.lock:
+            self.items.pop(key, None)
+
+class Group:
+    def __init__(self, group_id: str, title: str, admin_chat_id: int, join_code: str = None,
+                 reminder_time: str = DEFAULT_REMINDER_TIME):
+        self.group_id = group_id
+        self.title = title
+        self.admin_chat_id = admin_chat_id
+        self.join_code = join_code
+        self.reminder_time = reminder_time
+        if group_id == DEFAULT_GROUP_ID:
+            self.db_path = "attendance.db"
+            self.journal_path = EXCEL_FILE
+        else:
+            self.db_path = os.path.join(GROUPS_DIR, group_id, "attendance.db")
+            self.journal_path = os.path.join(GROUPS_DIR, group_id, "attendance_journal.xlsx")
+        self.journal_lock = threading.RLock()
+        self.mark_cache = MarkCache()
+        self.last_snapshot_seq = 0
+        self.calendar = SchoolCalendar()
+        self.matrix = AttendanceMatrix()
+        self.digest = AdminDigest(admin_chat_id)
+
+class GroupRegistry:
+    def __init__(self, path: str = GROUPS_DB):
+        self.path = path
+        self.default = Group(DEFAULT_GROUP_ID, "Основная группа", ADMIN_CHAT_ID)
+        self.groups: dict[str, Group] = {DEFAULT_GROUP_ID: self.default}
+        self.memberships: dict[int, str] = {}
+    
+    def load(self):
+        conn = sqlite3.connect(self.path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS groups (
+                group_id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                admin_chat_id INTEGER NOT NULL,
+                join_code TEXT NOT NULL UNIQUE,
+                reminder_time TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS memberships (
+                user_id INTEGER PRIMARY KEY,
+                group_id TEXT NOT NULL REFERENCES groups(group_id)
+            )
+        ''')
+        cursor.execute(
+            "INSERT OR IGNORE INTO groups (group_id, title, admin_chat_id, join_code, reminder_time) VALUES (?, ?, ?, ?, ?)",
+            (DEFAULT_GROUP_ID, self.default.title, ADMIN_CHAT_ID, secrets.token_urlsafe(6), DEFAULT_REMINDER_TIME)
+        )
+        cursor.execute("UPDATE groups SET admin_chat_id = ? WHERE group_id = ?", (ADMIN_CHAT_ID, DEFAULT_GROUP_ID))
+        conn.commit()
+        cursor.execute("SELECT group_id, title, admin_chat_id, join_code, reminder_time FROM groups ORDER BY created_at, group_id")
+        for group_id, title, admin_chat_id, join_code, reminder_time in cursor.fetchall():
+            group = self.groups.get(group_id)
+            if group is None:
+                self.groups[group_id] = Group(group_id, title, admin_chat_id, join_code, reminder_time)
+            else:
+                group.title, group.join_code, group.reminder_time = title, join_code, reminder_time
+        cursor.execute("SELECT user_id, group_id FROM memberships")
+        self.memberships = dict(cursor.fetchall())
+        conn.close()
+        logger.info("👥 Групп: %s, участников с назначенной группой: %s", len(self.groups), len(self.memberships))
+    
+    def all(self) -> list:
+        return list(self.groups.values())
+    
+    def by_join_code(self, join_code: str) -> Group:
+        return next((group for group in self.groups.values() if group.join_code == join_code), None)
+    
+    def group_for_user(self, user_id: int) -> Group:
+        group = self.groups.get(self.memberships.get(user_id))
+        if group is not None:
+            return group
+        return next((group for group in self.groups.values() if group.admin_chat_id == user_id), self.default)
+    
+    def create(self, admin_chat_id: int, title: str, reminder_time: str = DEFAULT_REMINDER_TIME) -> Group:
+        conn = sqlite3.connect(self.path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM groups")
+        group_id = f"g{cursor.fetchone()[0] + 1}"
+        while group_id in self.groups:
+            group_id = f"{group_id}_"
+        join_code = secrets.token_urlsafe(6)
+        cursor.execute(
+            "INSERT INTO groups (group_id, title, admin_chat_id, join_code, reminder_time) VALUES (?, ?, ?, ?, ?)",
+            (group_id, title, admin_chat_id, join_code, reminder_time)
+        )
+        conn.commit()
+        conn.close()
+        
+        os.makedirs(os.path.join(GROUPS_DIR, group_id), exist_ok=True)
+        group = Group(group_id, title, admin_chat_id, join_code, reminder_time)
+        self.groups[group_id] = group
+        return group
+    
+    def assign(self, user_ids: list, group_id: str):
+        moved = {}
+        for user_id in user_ids:
+            previous = self.group_for_user(user_id)
+            if previous.group_id != group_id:
+                moved.setdefault(previous, []).append(user_id)
+        
+        conn = sqlite3.connect(self.path)
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT OR REPLACE INTO memberships (user_id, group_id) VALUES (?, ?)",
+            [(user_id, group_id) for user_id in user_ids]
+        )
+        conn.commit()
+        conn.close()
+        for user_id in user_ids:
+            self.memberships[user_id] = group_id
+        
+        for previous, moved_ids in moved.items():
+            self.leave(previous, moved_ids)
+            logger.info("🔀 %s участников переведены из группы %s в %s", len(moved_ids), previous.group_id, group_id)
+    
+    def leave(self, group: Group, user_ids: list):
+        if not os.path.exists(group.db_path):
+            return
+        with group_context(group):
+            conn = connect_db()
+            cursor = conn.cursor()
+            cursor.executemany("DELETE FROM users WHERE user_id = ?", [(user_id,) for user_id in user_ids])
+            removed = cursor.rowcount
+            cursor.executemany(
+                "DELETE FROM reminder_log WHERE user_id = ? AND followup_sent_at IS NULL",
+                [(user_id,) for user_id in user_ids]
+            )
+            conn.commit()
+            conn.close()
+            if removed:
+                attendance_matrix.load()
+    
+    def members_elsewhere(self, user_ids: list, group_id: str) -> dict:
+        by_group = {}
+        for user_id in user_ids:
+            group = self.group_for_user(user_id)
+            if group.group_id != group_id and os.path.exists(group.db_path):
+                by_group.setdefault(group, []).append(user_id)
+        
+        found = {}
+        for group, ids in by_group.items():
+            with group_context(group):
+                conn = connect_db()
+                cursor = conn.cursor()
+                placeholders = ",".join("?" * len(ids))
+                cursor.execute(f"SELECT user_id FROM users WHERE user_id IN ({placeholders})", ids)
+                found.update((row[0], group) for row in cursor.fetchall())
+                conn.close()
+        return found
+
+group_registry = GroupRegistry()
+current_group_var: contextvars.ContextVar = contextvars.ContextVar("current_group", default=None)
+
+def current_group() -> Group:
+    return current_group_var.get() or group_registry.default
+
+@contextmanager
+def group_context(group: Group):
+    token = current_group_var.set(group)
+    try:
+        yield group
+    finally:
+        current_group_var.reset(token)
+
+class GroupLocal:
+    def __init__(self, attribute: str):
+        self.attribute = attribute
+    
+    def __getattr__(self, name: str):
+        return getattr(getattr(current_group(), self.attribute), name)
+
+school_calendar = GroupLocal("calendar")
+attendance_matrix = GroupLocal("matrix")
+admin_digest = GroupLocal("digest")
+
+def connect_db() -> sqlite3.Connection:
+    return sqlite3.connect(current_group().db_path)
+
+def journal_file() -> str:
+    return current_group().journal_path
+
+def is_admin(user_id: int) -> bool:
+    return user_id in (current_group().admin_chat_id, ADMIN_CHAT_ID)
 
 def get_weekdays(start_date: datetime, days_ahead: int = 30) -> list:
-    weekdays = []
-    current_date = start_date
-    for _ in range(days_ahead):
-        if current_date.weekday() < 6:
-            weekdays.append(current_date.strftime("%d.%m.%Y"))
-        current_date += timedelta(days=1)
-    return weekdays
+    if days_ahead <= 0:
+        return []
+    return school_calendar.school_days_between(start_date, as_date(start_date) + timedelta(days=days_ahead - 1))
 
 def parse_date(date_str: str) -> datetime:
     parts = date_str.split('.')
@@ -75,13 +914,7 @@ def parse_date(date_str: str) -> datetime:
     return datetime(year, month, day)
 
 def get_date_range(start_date: datetime, end_date: datetime) -> list:
-    dates = []
-    current = start_date
-    while current <= end_date:
-        if current.weekday() < 6:
-            dates.append(current.strftime("%d.%m.%Y"))
-        current += timedelta(days=1)
-    return dates
+    return school_calendar.school_days_between(start_date, end_date)
 
 def ensure_dates_in_excel(ws, start_date: datetime = None, days_ahead: int = 30):
     if start_date is None:
@@ -124,12 +957,12 @@ def ensure_dates_in_excel(ws, start_date: datetime = None, days_ahead: int = 30)
             new_dates_added += 1
     
     if new_dates_added > 0:
-        print(f"✅ Добавлено {new_dates_added} новых учебных дат (пн-сб) в журнал")
+        logger.info("✅ Добавлено %s новых учебных дат в журнал", new_dates_added)
     return new_dates_added
 
 def init_db():
     try:
-        conn = sqlite3.connect('attendance.db')
+        conn = connect_db()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -164,18 +997,246 @@ def init_db():
             )
         ''')
         
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS marks (
+                user_id INTEGER NOT NULL,
+                date TEXT NOT NULL,
+                status TEXT NOT NULL,
+                reason TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, date),
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reminder_log (
+                user_id INTEGER NOT NULL,
+                target_date TEXT NOT NULL,
+                sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                followup_sent_at TIMESTAMP,
+                PRIMARY KEY (target_date, user_id),
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS attendance_events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                date TEXT,
+                end_date TEXT,
+                status TEXT,
+                reason TEXT,
+                ref_id INTEGER
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_attendance_events_ts ON attendance_events(ts)")
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS attendance_events_no_update
+            BEFORE UPDATE ON attendance_events
+            BEGIN SELECT RAISE(ABORT, 'attendance_events is append-only'); END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS attendance_events_no_delete
+            BEFORE DELETE ON attendance_events
+            BEGIN SELECT RAISE(ABORT, 'attendance_events is append-only'); END
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS attendance_snapshots (
+                seq INTEGER PRIMARY KEY,
+                ts INTEGER NOT NULL,
+                data BLOB NOT NULL
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS holidays (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                start_date TEXT NOT NULL,
+                end_date TEXT NOT NULL,
+                title TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
         cursor.execute("PRAGMA table_info(users)")
         columns = [col[1] for col in cursor.fetchall()]
         if 'username' not in columns:
             cursor.execute("ALTER TABLE users ADD COLUMN username TEXT")
+        if 'reminder_time' not in columns:
+            cursor.execute(f"ALTER TABLE users ADD COLUMN reminder_time TEXT NOT NULL DEFAULT '{DEFAULT_REMINDER_TIME}'")
+        
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_reminder_time ON users(reminder_time)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username COLLATE NOCASE)")
+        
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'")
+        fts_exists = cursor.fetchone() is not None
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+                    name, username, content='users', content_rowid='user_id', tokenize='trigram'
+                )
+            ''')
+        except sqlite3.OperationalError:
+            logger.error("❌ SQLite без токенизатора trigram: поиск студентов будет перебирать таблицу users без индекса")
+            for trigger in ("users_fts_insert", "users_fts_delete", "users_fts_update"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            cursor.execute("DROP TABLE IF EXISTS users_fts")
+        else:
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+                    INSERT INTO users_fts (rowid, name, username) VALUES (new.user_id, new.name, new.username);
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+                    INSERT INTO users_fts (users_fts, rowid, name, username) VALUES ('delete', old.user_id, old.name, old.username);
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF name, username ON users BEGIN
+                    INSERT INTO users_fts (users_fts, rowid, name, username) VALUES ('delete', old.user_id, old.name, old.username);
+                    INSERT INTO users_fts (rowid, name, username) VALUES (new.user_id, new.name, new.username);
+                END
+            ''')
+            if not fts_exists:
+                cursor.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+        
+        for table in RETENTION_TABLES:
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}_archive AS SELECT * FROM {table} WHERE 0")
+            cursor.execute(f"PRAGMA table_info({table}_archive)")
+            archive_columns = {col[1] for col in cursor.fetchall()}
+            cursor.execute(f"PRAGMA table_info({table})")
+            for col in cursor.fetchall():
+                if col[1] not in archive_columns:
+                    cursor.execute(f"ALTER TABLE {table}_archive ADD COLUMN {col[1]} {col[2]}")
+            if "archived_at" not in archive_columns:
+                cursor.execute(f"ALTER TABLE {table}_archive ADD COLUMN archived_at TIMESTAMP")
         
         conn.commit()
+        
+        cursor.execute("PRAGMA auto_vacuum")
+        if cursor.fetchone()[0] != 2:
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            cursor.execute("VACUUM")
+            logger.info("🧹 Включён инкрементальный auto_vacuum")
         conn.close()
-        print("✅ База данных инициализирована")
+        logger.info("✅ База данных инициализирована")
     except Exception as e:
-        print(f"❌ Ошибка инициализации БД: {e}")
+        logger.exception("❌ Ошибка инициализации БД: %s", e)
         raise
 
+def database_pages() -> tuple[int, int, int]:
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA page_count")
+    page_count = cursor.fetchone()[0]
+    cursor.execute("PRAGMA freelist_count")
+    freelist_count = cursor.fetchone()[0]
+    cursor.execute("PRAGMA page_size")
+    page_size = cursor.fetchone()[0]
+    conn.close()
+    return page_count, freelist_count, page_size
+
+def archive_step(table: str, date_column: str, cutoff: str, budget: float = MAINTENANCE_STEP_SECONDS) -> tuple[int, bool]:
+    deadline = time.perf_counter() + budget
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute(f"PRAGMA table_info({table})")
+    columns = ", ".join(col[1] for col in cursor.fetchall())
+    moved = 0
+    done = False
+    while not done and time.perf_counter() < deadline:
+        cursor.execute(
+            f"SELECT rowid FROM {table} WHERE {sql_iso_date(date_column)} < ? LIMIT ?",
+            (cutoff, MAINTENANCE_BATCH_ROWS)
+        )
+        rowids = [row[0] for row in cursor.fetchall()]
+        if rowids:
+            placeholders = ",".join("?" * len(rowids))
+            cursor.execute(f'''
+                INSERT INTO {table}_archive ({columns}, archived_at)
+                SELECT {columns}, CURRENT_TIMESTAMP FROM {table} WHERE rowid IN ({placeholders})
+            ''', rowids)
+            cursor.execute(f"DELETE FROM {table} WHERE rowid IN ({placeholders})", rowids)
+            conn.commit()
+            moved += len(rowids)
+        done = len(rowids) < MAINTENANCE_BATCH_ROWS
+    conn.close()
+    return moved, done
+
+def analyze_database():
+    conn = connect_db()
+    conn.execute("PRAGMA analysis_limit = 1000")
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+def vacuum_step(budget: float = MAINTENANCE_STEP_SECONDS) -> bool:
+    deadline = time.perf_counter() + budget
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA auto_vacuum")
+    if cursor.fetchone()[0] != 2:
+        conn.close()
+        return True
+    
+    done = False
+    while not done and time.perf_counter() < deadline:
+        cursor.execute("PRAGMA freelist_count")
+        free_pages = cursor.fetchone()[0]
+        cursor.execute(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})").fetchall()
+        conn.commit()
+        cursor.execute("PRAGMA freelist_count")
+        remaining = cursor.fetchone()[0]
+        done = remaining == 0 or remaining >= free_pages
+    conn.close()
+    return done
+
+async def run_db_maintenance() -> str:
+    started = time.perf_counter()
+    pages_before, free_before, page_size = await asyncio.to_thread(database_pages)
+    
+    archived = {}
+    if RETENTION_DAYS > 0:
+        cutoff = to_iso_key((datetime.now(TIMEZONE) - timedelta(days=RETENTION_DAYS)).strftime("%d.%m.%Y"))
+        for table, date_column in RETENTION_TABLES.items():
+            done = False
+            while not done:
+                moved, done = await asyncio.to_thread(archive_step, table, date_column, cutoff)
+                archived[table] = archived.get(table, 0) + moved
+                await asyncio.sleep(0)
+    
+    await asyncio.to_thread(analyze_database)
+    await asyncio.sleep(0)
+    
+    done = False
+    while not done:
+        done = await asyncio.to_thread(vacuum_step)
+        await asyncio.sleep(0)
+    
+    pages_after, free_after, _ = await asyncio.to_thread(database_pages)
+    reclaimed_kb = max(pages_before - pages_after, 0) * page_size // 1024
+    duration = round(time.perf_counter() - started, 2)
+    archived_text = ", ".join(f"{table}: {count}" for table, count in archived.items() if count) or "нет"
+    logger.info(
+        "🧹 Обслуживание БД: в архив %s, освобождено %s КБ (%s → %s страниц), свободных страниц %s → %s",
+        archived_text, reclaimed_kb, pages_before, pages_after, free_before, free_after,
+        extra={"handler": "run_db_maintenance", "group": current_group().group_id, "duration_ms": round(duration * 1000, 1)}
+    )
+    report = (
+        f"🧹 Обслуживание базы «{current_group().title}»\n"
+        f"📦 В архив: {archived_text}\n"
+        f"💾 Освобождено: {reclaimed_kb} КБ\n"
+        f"⏱ Длительность: {duration} с"
+    )
+    await admin_digest.add(report)
+    return report
+
 def init_excel():
     wb = Workbook()
     ws = wb.active
@@ -198,101 +1259,405 @@ def init_excel():
     ws.column_dimensions['C'].width = 20
     
     ensure_dates_in_excel(ws, datetime.now(), 30)
-    wb.save(EXCEL_FILE)
-    print(f"✅ Создан Excel-файл: {EXCEL_FILE}")
+    wb.save(journal_file())
+    logger.info("✅ Создан Excel-файл: %s", journal_file())
 
-def ensure_user_in_excel(user_id: int, name: str, username: str = None):
+def ensure_users_in_excel(users: list) -> bool:
     try:
-        if not os.path.exists(EXCEL_FILE):
-            init_excel()
+        with current_group().journal_lock:
+            if not os.path.exists(journal_file()):
+                init_excel()
             
-        wb = load_workbook(EXCEL_FILE)
-        ws = wb.active
-        
-        user_exists = False
-        for row in range(2, ws.max_row + 1):
-            if ws.cell(row=row, column=1).value == user_id:
-                user_exists = True
+            wb = load_workbook(journal_file())
+            ws = wb.active
+            _, user_rows = journal_index(ws)
+            
+            added = 0
+            for user_id, name, username in users:
+                row = user_rows.get(user_id)
+                if row is None:
+                    row = ws.max_row + 1
+                    ws.cell(row=row, column=1, value=user_id)
+                    user_rows[user_id] = row
+                    added += 1
                 ws.cell(row=row, column=2, value=name)
                 ws.cell(row=row, column=3, value=f"@{username}" if username else "")
-                break
-        
-        if not user_exists:
-            new_row = ws.max_row + 1
-            ws.cell(row=new_row, column=1, value=user_id)
-            ws.cell(row=new_row, column=2, value=name)
-            ws.cell(row=new_row, column=3, value=f"@{username}" if username else "")
-            print(f"✅ Добавлен новый пользователь в Excel: {name} (ID: {user_id})")
-        
-        wb.save(EXCEL_FILE)
+            
+            wb.save(journal_file())
+        if added:
+            logger.info("✅ Добавлено новых пользователей в Excel: %s", added)
         return True
-        
+    
     except Exception as e:
-        print(f"❌ Ошибка проверки пользователя в Excel: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Ошибка проверки пользователей в Excel: %s", e)
         return False
 
-def update_attendance_in_excel(user_id: int, date_str: str, status: str, reason: str = None):
-    try:
-        conn = sqlite3.connect('attendance.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT name, username FROM users WHERE user_id = ?", (user_id,))
-        user_data = cursor.fetchone()
-        conn.close()
-        
-        if not user_data:
-            print(f"⚠️ Пользователь ID {user_id} не найден в БД")
+def ensure_user_in_excel(user_id: int, name: str, username: str = None):
+    return ensure_users_in_excel([(user_id, name, username)])
+
+def extend_journal():
+    with current_group().journal_lock:
+        if not os.path.exists(journal_file()):
+            init_excel()
             return
-        
-        name, username = user_data
-        ensure_user_in_excel(user_id, name, username)
-        
-        wb = load_workbook(EXCEL_FILE)
+        wb = load_workbook(journal_file())
         ws = wb.active
         ensure_dates_in_excel(ws, datetime.now(), 30)
+        wb.save(journal_file())
+
+def build_journal() -> bytes:
+    with current_group().journal_lock:
+        extend_journal()
+        with open(journal_file(), "rb") as journal:
+            return journal.read()
+
+def reconcile_journal() -> tuple[int, int]:
+    state, seq = rebuild_state()
+    with current_group().journal_lock:
+        if not os.path.exists(journal_file()):
+            init_excel()
+        wb = load_workbook(journal_file())
+        written = apply_marks_to_journal(wb.active, state_marks(state), clear_known=mark_history_keys())
+        wb.save(journal_file())
+    return seq, written
+
+def build_journal_at(max_ts: int) -> tuple[bytes, int]:
+    state, seq = rebuild_state(max_ts=max_ts)
+    with current_group().journal_lock:
+        if not os.path.exists(journal_file()):
+            init_excel()
+        wb = load_workbook(journal_file())
+    apply_marks_to_journal(wb.active, state_marks(state), clear_known=mark_history_keys())
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue(), seq
+
+def append_event(cursor, kind: str, user_id: int, date: str = None, end_date: str = None,
+                 status: str = None, reason: str = None, ref_id: int = None) -> int:
+    cursor.execute('''
+        INSERT INTO attendance_events (ts, kind, user_id, date, end_date, status, reason, ref_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (int(time.time()), kind, user_id, date, end_date, status, reason, ref_id))
+    return cursor.lastrowid
+
+def apply_event(state: dict, kind: str, user_id: int, date: str, end_date: str,
+                status: str, reason: str, ref_id: int):
+    key = f"{user_id}|{date}"
+    if kind == "mark":
+        state["marks"][key] = [status, reason]
+    elif kind == "unmark":
+        state["marks"].pop(key, None)
+    elif kind == "period_add":
+        state["periods"][str(ref_id)] = [user_id, date, end_date, reason]
+    elif kind == "period_del":
+        state["periods"].pop(str(ref_id), None)
+
+def load_snapshot(cursor, max_seq: int = None, max_ts: int = None) -> tuple[dict, int]:
+    cursor.execute('''
+        SELECT seq, data FROM attendance_snapshots
+        WHERE (? IS NULL OR seq <= ?) AND (? IS NULL OR ts <= ?)
+        ORDER BY seq DESC LIMIT 1
+    ''', (max_seq, max_seq, max_ts, max_ts))
+    row = cursor.fetchone()
+    if row is None:
+        return {"marks": {}, "periods": {}}, 0
+    return json.loads(zlib.decompress(row[1])), row[0]
+
+def rebuild_state(max_seq: int = None, max_ts: int = None) -> tuple[dict, int]:
+    conn = connect_db()
+    cursor = conn.cursor()
+    state, seq = load_snapshot(cursor, max_seq, max_ts)
+    cursor.execute('''
+        SELECT seq, kind, user_id, date, end_date, status, reason, ref_id
+        FROM attendance_events
+        WHERE seq > ? AND (? IS NULL OR seq <= ?) AND (? IS NULL OR ts <= ?)
+        ORDER BY seq
+    ''', (seq, max_seq, max_seq, max_ts, max_ts))
+    for event in cursor:
+        seq = event[0]
+        apply_event(state, *event[1:])
+    conn.close()
+    return state, seq
+
+def take_snapshot() -> int:
+    state, seq = rebuild_state()
+    conn = connect_db()
+    cursor = conn.cursor()
+    data = zlib.compress(json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    cursor.execute(
+        "INSERT OR REPLACE INTO attendance_snapshots (seq, ts, data) VALUES (?, ?, ?)",
+        (seq, int(time.time()), data)
+    )
+    conn.commit()
+    conn.close()
+    current_group().last_snapshot_seq = seq
+    logger.info("📸 Снимок журнала событий: seq %s, %s отметок, %s байт", seq, len(state["marks"]), len(data))
+    return seq
+
+def maybe_snapshot(seq: int):
+    if seq - current_group().last_snapshot_seq >= SNAPSHOT_EVERY_EVENTS:
+        try:
+            take_snapshot()
+        except Exception as e:
+            logger.exception("❌ Ошибка снимка журнала событий: %s", e)
+
+def init_event_log():
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT MAX(seq) FROM attendance_snapshots")
+    snapshot_seq = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(*) FROM attendance_events")
+    has_events = cursor.fetchone()[0] > 0
+    
+    if snapshot_seq is None and not has_events:
+        journal_marks = read_journal_marks()
+        cursor.executemany(
+            "INSERT OR IGNORE INTO marks (user_id, date, status, reason) VALUES (?, ?, ?, ?)",
+            [(user_id, date_str, status, reason) for (user_id, date_str), (status, reason) in journal_marks.items()]
+        )
+        cursor.execute("SELECT user_id, date, status, reason FROM marks")
+        marks = {f"{user_id}|{date}": [status, reason] for user_id, date, status, reason in cursor.fetchall()}
+        cursor.execute("SELECT id, user_id, start_date, end_date, reason FROM absence_periods")
+        periods = {str(period_id): [user_id, start, end, reason] for period_id, user_id, start, end, reason in cursor.fetchall()}
+        data = zlib.compress(json.dumps({"marks": marks, "periods": periods}, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        cursor.execute("INSERT INTO attendance_snapshots (seq, ts, data) VALUES (0, ?, ?)", (int(time.time()), data))
+        conn.commit()
+        snapshot_seq = 0
+        logger.info(
+            "📸 Начальный снимок журнала событий: %s отметок (из Excel: %s), %s периодов",
+            len(marks), len(journal_marks), len(periods)
+        )
+    
+    conn.close()
+    current_group().last_snapshot_seq = snapshot_seq or 0
+
+def normalize_mark(status: str, reason: str = None) -> tuple[str, str]:
+    return status, (reason if status == "❌" and reason else None)
+
+def is_mark_unchanged(user_id: int, date_str: str, status: str, reason: str = None) -> bool:
+    key = (user_id, date_str)
+    mark = normalize_mark(status, reason)
+    cached = current_group().mark_cache.get(key)
+    if cached is None:
+        try:
+            conn = connect_db()
+            cursor = conn.cursor()
+            cursor.execute("SELECT status, reason FROM marks WHERE user_id = ? AND date = ?", key)
+            row = cursor.fetchone()
+            conn.close()
+        except Exception as e:
+            logger.warning("⚠️ Не удалось прочитать отметку из БД: %s", e)
+            return False
+        if row is None:
+            return False
+        cached = (row[0], row[1])
+        current_group().mark_cache.put(key, cached)
+    return cached == mark
+
+def store_mark(user_id: int, date_str: str, status: str, reason: str = None):
+    status, reason = normalize_mark(status, reason)
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO marks (user_id, date, status, reason) VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id, date) DO UPDATE SET
+            status = excluded.status,
+            reason = excluded.reason,
+            updated_at = CURRENT_TIMESTAMP
+    ''', (user_id, date_str, status, reason))
+    seq = append_event(cursor, "mark", user_id, date_str, status=status, reason=reason)
+    conn.commit()
+    conn.close()
+    current_group().mark_cache.put((user_id, date_str), (status, reason))
+    attendance_matrix.set_mark(user_id, date_str, status)
+    maybe_snapshot(seq)
+
+def clear_marks(cells: list) -> list:
+    if not cells:
+        return []
+    conn = connect_db()
+    cursor = conn.cursor()
+    cleared = []
+    for user_id, date_str in cells:
+        cursor.execute("DELETE FROM marks WHERE user_id = ? AND date = ?", (user_id, date_str))
+        if cursor.rowcount:
+            seq = append_event(cursor, "unmark", user_id, date_str)
+            cleared.append((user_id, date_str))
+        current_group().mark_cache.pop((user_id, date_str))
+    conn.commit()
+    conn.close()
+    for user_id, date_str in cleared:
+        attendance_matrix.set_mark(user_id, date_str, None)
+    if cleared:
+        maybe_snapshot(seq)
+    return cleared
+
+def journal_index(ws) -> tuple[dict, dict]:
+    date_cols = {}
+    for col in range(4, ws.max_column + 1):
+        cell_value = ws.cell(row=1, column=col).value
+        if cell_value:
+            date_cols[str(cell_value)] = col
+    user_rows = {}
+    for row in range(2, ws.max_row + 1):
+        cell_value = ws.cell(row=row, column=1).value
+        if cell_value is not None:
+            user_rows[cell_value] = row
+    return date_cols, user_rows
+
+def style_mark_cell(cell, status: str = None, reason: str = None):
+    if status is None:
+        cell.value = None
+        cell.fill = PatternFill(fill_type=None)
+        return
+    
+    status_text = status
+    if reason and status == "❌":
+        status_text += f"\n({reason})"
+    
+    cell.value = status_text
+    cell.alignment = Alignment(wrap_text=True, horizontal="center")
+    if status == "✅":
+        cell.fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
+    else:
+        cell.fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+
+def apply_marks_to_journal(ws, marks: dict, clear_known: set = None) -> int:
+    date_cols, user_rows = journal_index(ws)
+    written = 0
+    for (user_id, date_str), mark in marks.items():
+        col = date_cols.get(date_str)
+        row = user_rows.get(user_id)
+        if col is None or row is None:
+            continue
+        style_mark_cell(ws.cell(row=row, column=col), *(mark or (None, None)))
+        written += 1
+    
+    for user_id, date_str in clear_known or ():
+        col = date_cols.get(date_str)
+        row = user_rows.get(user_id)
+        if (user_id, date_str) in marks or col is None or row is None:
+            continue
+        if ws.cell(row=row, column=col).value is not None:
+            style_mark_cell(ws.cell(row=row, column=col))
+            written += 1
+    return written
+
+def parse_mark_cell(value) -> tuple[str, str]:
+    text = str(value or "").strip()
+    for status in ("✅", "❌"):
+        if text.startswith(status):
+            reason = text[len(status):].strip()
+            if reason.startswith("(") and reason.endswith(")"):
+                reason = reason[1:-1].strip()
+            return normalize_mark(status, reason or None)
+    return None
+
+def read_journal_marks() -> dict:
+    with current_group().journal_lock:
+        if not os.path.exists(journal_file()):
+            return {}
+        wb = load_workbook(journal_file())
+    ws = wb.active
+    date_cols, user_rows = journal_index(ws)
+    marks = {}
+    for user_id, row in user_rows.items():
+        for date_str, col in date_cols.items():
+            mark = parse_mark_cell(ws.cell(row=row, column=col).value)
+            if mark:
+                marks[(user_id, date_str)] = mark
+    return marks
+
+def mark_history_keys() -> set:
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT data FROM attendance_snapshots ORDER BY seq LIMIT 1")
+    row = cursor.fetchone()
+    keys = set()
+    if row:
+        for key in json.loads(zlib.decompress(row[0]))["marks"]:
+            user_id, date_str = key.split("|", 1)
+            keys.add((int(user_id), date_str))
+    cursor.execute("SELECT DISTINCT user_id, date FROM attendance_events WHERE kind IN ('mark', 'unmark')")
+    keys.update(cursor.fetchall())
+    conn.close()
+    return keys
+
+def state_marks(state: dict) -> dict:
+    marks = {}
+    for key, (status, reason) in state["marks"].items():
+        user_id, date_str = key.split("|", 1)
+        marks[(int(user_id), date_str)] = (status, reason)
+    return marks
+
+def clear_journal_cells(cells: list):
+    with current_group().journal_lock:
+        if not cells or not os.path.exists(journal_file()):
+            return
+        wb = load_workbook(journal_file())
+        apply_marks_to_journal(wb.active, {cell: None for cell in cells})
+        wb.save(journal_file())
+
+def update_attendance_in_excel(user_id: int, date_str: str, status: str, reason: str = None) -> bool:
+    if is_mark_unchanged(user_id, date_str, status, reason):
+        logger.info(
+            "⏭️ Отметка не изменилась: дата %s, статус %s", date_str, status,
+            extra={"user_id": user_id, "sampled": True}
+        )
+        return False
+    
+    try:
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("SELECT name, username FROM users WHERE user_id = ?", (user_id,))
+        user_data = cursor.fetchone()
+        conn.close()
         
-        date_col = None
-        for col in range(4, ws.max_column + 1):
-            cell_value = ws.cell(row=1, column=col).value
-            if str(cell_value) == date_str:
-                date_col = col
-                break
-        
-        if date_col is None:
-            print(f"❌ Дата {date_str} не найдена в Excel")
-            return
-        
-        user_row = None
-        for row in range(2, ws.max_row + 1):
-            if ws.cell(row=row, column=1).value == user_id:
-                user_row = row
-                break
-        
-        if user_row is None:
-            print(f"❌ Не удалось найти пользователя ID {user_id} в Excel")
-            return
-        
-        status_text = status
-        if reason and status == "❌":
-            status_text += f"\n({reason})"
-        
-        ws.cell(row=user_row, column=date_col, value=status_text)
-        ws.cell(row=user_row, column=date_col).alignment = Alignment(wrap_text=True, horizontal="center")
-        
-        if status == "✅":
-            fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-        else:
-            fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+        if not user_data:
+            logger.warning("⚠️ Пользователь ID %s не найден в БД", user_id)
+            return False
         
-        ws.cell(row=user_row, column=date_col).fill = fill
-        wb.save(EXCEL_FILE)
-        print(f"✅ Обновлена посещаемость: ID {user_id}, дата {date_str}, статус {status}")
+        name, username = user_data
+        with current_group().journal_lock:
+            ensure_user_in_excel(user_id, name, username)
+            
+            wb = load_workbook(journal_file())
+            ws = wb.active
+            ensure_dates_in_excel(ws, datetime.now(), 30)
+            
+            date_col = None
+            for col in range(4, ws.max_column + 1):
+                cell_value = ws.cell(row=1, column=col).value
+                if str(cell_value) == date_str:
+                    date_col = col
+                    break
+            
+            if date_col is None:
+                logger.error("❌ Дата %s не найдена в Excel", date_str)
+                return False
+            
+            user_row = None
+            for row in range(2, ws.max_row + 1):
+                if ws.cell(row=row, column=1).value == user_id:
+                    user_row = row
+                    break
+            
+            if user_row is None:
+                logger.error("❌ Не удалось найти пользователя ID %s в Excel", user_id)
+                return False
+            
+            style_mark_cell(ws.cell(row=user_row, column=date_col), status, reason)
+            wb.save(journal_file())
+            store_mark(user_id, date_str, status, reason)
+        logger.info(
+            "✅ Обновлена посещаемость: дата %s, статус %s", date_str, status,
+            extra={"user_id": user_id, "sampled": True}
+        )
+        return True
         
     except Exception as e:
-        print(f"❌ Ошибка обновления Excel: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Ошибка обновления Excel: %s", e, extra={"user_id": user_id})
+        return False
 
 def get_main_kb():
     return ReplyKeyboardMarkup(
@@ -304,6 +1669,17 @@ def get_main_kb():
         one_time_keyboard=False
     )
 
+def get_reminder_kb(date_str: str):
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="✅ Буду", callback_data=MarkCallback(action="present", date=date_str).pack()),
+                InlineKeyboardButton(text="❌ Не буду", callback_data=MarkCallback(action="absent", date=date_str).pack())
+            ],
+            [InlineKeyboardButton(text="📝 Не буду, укажу причину", callback_data=MarkCallback(action="reason", date=date_str).pack())]
+        ]
+    )
+
 def get_cancel_kb():
     return ReplyKeyboardMarkup(
         keyboard=[[KeyboardButton(text="🚫 Отмена")]],
@@ -311,6 +1687,32 @@ def get_cancel_kb():
         one_time_keyboard=True
     )
 
+def get_reminder_time_kb():
+    return ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text="18:00"), KeyboardButton(text="19:00"), KeyboardButton(text="20:00")],
+            [KeyboardButton(text="21:00"), KeyboardButton(text="22:00"), KeyboardButton(text="23:00")],
+            [KeyboardButton(text="🚫 Отмена")]
+        ],
+        resize_keyboard=True,
+        one_time_keyboard=True
+    )
+
+def validate_reminder_time(time_str: str) -> tuple[bool, str]:
+    time_str = time_str.strip()
+    match = re.match(r'^(\d{1,2})[:.](\d{2})$', time_str)
+    if not match:
+        return False, "Неверный формат. Используй ЧЧ:ММ (например, 20:30)"
+    
+    hours, minutes = int(match.group(1)), int(match.group(2))
+    if hours > 23 or minutes > 59:
+        return False, "Некорректное время"
+    
+    normalized = f"{hours:02d}:{minutes:02d}"
+    if normalized < REMINDER_EARLIEST:
+        return False, f"Напоминание можно поставить с {REMINDER_EARLIEST} до 23:59"
+    return True, normalized
+
 def validate_and_normalize_date(date_str: str) -> tuple[bool, str]:
     date_str = date_str.strip()
     if not re.match(r'^\d{1,2}\.\d{1,2}(\.\d{4})?$', date_str):
@@ -318,19 +1720,146 @@ def validate_and_normalize_date(date_str: str) -> tuple[bool, str]:
     
     try:
         dt = parse_date(date_str)
-        return True, dt.strftime("%d.%m.%Y")
     except:
         return False, "Некорректная дата"
+    
+    lower, upper = calendar_bounds()
+    if not lower <= dt.date() <= upper:
+        return False, f"Дата должна быть в пределах {lower.strftime('%d.%m.%Y')}–{upper.strftime('%d.%m.%Y')}"
+    return True, dt.strftime("%d.%m.%Y")
+
+def is_markable_date(date_str: str) -> bool:
+    try:
+        day = as_date(date_str)
+    except (TypeError, ValueError):
+        return False
+    return day.strftime("%d.%m.%Y") == date_str and school_calendar.is_school_day(day)
+
+def record_absence(user_id: int, date: str, reason: str = None):
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT name, username FROM users WHERE user_id = ?", (user_id,))
+    user_row = cursor.fetchone()
+    if not user_row:
+        conn.close()
+        return None
+    
+    cursor.execute("INSERT INTO absences (user_id, date, reason) VALUES (?, ?, ?)", (user_id, date, reason))
+    append_event(cursor, "absence", user_id, date, reason=reason, ref_id=cursor.lastrowid)
+    conn.commit()
+    conn.close()
+    return user_row
+
+def is_today_or_past(date_str: str) -> bool:
+    return to_iso_key(date_str) <= to_iso_key(datetime.now(TIMEZONE).strftime("%d.%m.%Y"))
+
+async def notify_admin_absence(user_id: int, user_name: str, user_username: str, date: str, reason: str = None):
+    username_display = f" (@{user_username})" if user_username else ""
+    reason_text = f"\n📝 Причина: {reason}" if reason else ""
+    await admin_digest.add(
+        f"⚠️ Отсутствие\n👤 {user_name}{username_display} (ID: {user_id})\n📅 {date}{reason_text}",
+        urgent=is_today_or_past(date)
+    )
+
+def build_reminder_text(name: str, username: str, day_name: str, date_str: str) -> str:
+    username_display = f" (@{username})" if username else ""
+    return (
+        f"🌙 Вечернее напоминание\n\n"
+        f"{name}{username_display}, будешь завтра ({day_name}) на парах?\n\n"
+        f"📅 Завтра: {date_str}"
+    )
+
+async def edit_reminder_result(chat_id: int, message_id: int, reminder_text: str, result: str, keep_keyboard_for: str = None):
+    base_text = reminder_text.split("\n\n📌 ")[0]
+    try:
+        await bot.edit_message_text(
+            text=f"{base_text}\n\n📌 {result}",
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=get_reminder_kb(keep_keyboard_for) if keep_keyboard_for else None
+        )
+    except TelegramAPIError as e:
+        logger.warning("⚠️ Не удалось обновить напоминание для ID %s: %s", chat_id, e)
+
+def sql_iso_date(column: str) -> str:
+    return f"(substr({column}, 7, 4) || substr({column}, 4, 2) || substr({column}, 1, 2))"
+
+def to_iso_key(date_str: str) -> str:
+    return date_str[6:10] + date_str[3:5] + date_str[0:2]
+
+def trigrams(text: str) -> set:
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def search_users_batch(queries: list, limit: int = 5) -> dict:
+    queries = [query.strip().lstrip('@').lower() for query in queries]
+    all_trigrams = set().union(*(trigrams(query) for query in queries)) if queries else set()
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'users_fts'")
+    fts_sql = cursor.fetchone()
+    candidates = []
+    if all_trigrams and fts_sql and "trigram" in fts_sql[0]:
+        match = " OR ".join('"' + trigram.replace('"', '""') + '"' for trigram in sorted(all_trigrams))
+        cursor.execute('''
+            SELECT u.user_id, u.name, u.username
+            FROM users_fts JOIN users u ON u.user_id = users_fts.rowid
+            WHERE users_fts MATCH ?
+            ORDER BY rank
+            LIMIT 500
+        ''', (match,))
+        candidates = cursor.fetchall()
+    elif all_trigrams:
+        conn.create_function("shares_trigram", 1, lambda text: bool(text) and not all_trigrams.isdisjoint(trigrams(text)))
+        cursor.execute("""
+            SELECT user_id, name, username FROM users
+            WHERE shares_trigram(name) OR shares_trigram(username)
+            LIMIT 500
+        """)
+        candidates = cursor.fetchall()
+    
+    short_queries = [query for query in queries if query and len(query) < 3]
+    if short_queries:
+        conditions = " OR ".join("name LIKE ? ESCAPE '\\' OR username LIKE ? ESCAPE '\\'" for _ in short_queries)
+        params = [
+            query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            for query in short_queries for _ in range(2)
+        ]
+        cursor.execute(f"SELECT user_id, name, username FROM users WHERE {conditions} LIMIT 500", params)
+        candidates += cursor.fetchall()
+    conn.close()
+    
+    results = {}
+    for query in queries:
+        query_trigrams = trigrams(query)
+        scored = {}
+        for user_id, name, username in candidates:
+            haystacks = [name.lower(), (username or "").lower()]
+            if query_trigrams:
+                score = max(len(query_trigrams & trigrams(text)) / len(query_trigrams) for text in haystacks)
+            else:
+                score = 1.0 if query and any(text.startswith(query) for text in haystacks) else 0.0
+            if score > scored.get(user_id, (0,))[0]:
+                scored[user_id] = (score, name, username)
+        ranked = sorted(
+            ((score, user_id, name, username) for user_id, (score, name, username) in scored.items()),
+            key=lambda item: (-item[0], item[2])
+        )
+        results[query] = ranked[:limit]
+    return results
+
+def search_users(query: str, limit: int = 10) -> list:
+    return next(iter(search_users_batch([query], limit).values()), [])
 
 def is_user_absent_today(user_id: int, today: str) -> bool:
     try:
-        conn = sqlite3.connect('attendance.db')
+        conn = connect_db()
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id FROM absence_periods 
-            WHERE user_id = ? 
-            AND ? BETWEEN start_date AND end_date
-        """, (user_id, today))
+        cursor.execute(f"""
+            SELECT id FROM absence_periods
+            WHERE user_id = ?
+            AND ? BETWEEN {sql_iso_date('start_date')} AND {sql_iso_date('end_date')}
+        """, (user_id, to_iso_key(today)))
         result = cursor.fetchone()
         conn.close()
         return result is not None
@@ -343,13 +1872,28 @@ async def cmd_help(message: Message):
         "ℹ️ Команды:\n"
         "/start — начать диалог\n"
         "/rename — изменить имя\n"
+        "/remind — время вечернего напоминания\n"
         "/history — история отсутствий\n"
         "/absence — активные периоды отсутствия\n"
         "/clear_absence — удалить периоды\n"
         "/duty — назначить дежурных (админ)\n"
+        "/find — поиск студента по имени или юзернейму (админ)\n"
+        "/join — перейти в группу по коду приглашения\n"
+        "/groups — список групп (главный админ)\n"
+        "/new_group — создать группу (главный админ)\n"
         "/journal — получить Excel-журнал (админ)\n"
+        "/buckets — нагрузка по времени напоминаний (админ)\n"
+        "/reconcile — сверить журнал с историей (админ)\n"
+        "/absent — кто отсутствует в день (админ)\n"
+        "/stats — статистика пропусков (админ)\n"
+        "/import_roster — загрузить список группы CSV/XLSX (админ)\n"
+        "/export_roster — выгрузить список группы (админ)\n"
+        "/journal_at — журнал на момент времени (админ)\n"
+        "/holidays — праздники и каникулы\n"
+        "/holiday — добавить праздник/каникулы (админ)\n"
+        "/del_holiday — удалить праздник (админ)\n"
         "/support — поддержать разработчика ❤️\n\n"
-        "📅 Учебные дни: понедельник-суббота"
+        "📅 Учебные дни: понедельник-суббота, кроме праздников и каникул"
     )
     await message.answer(help_text)
 
@@ -377,7 +1921,7 @@ async def process_new_name(message: Message, state: FSMContext):
     username = message.from_user.username
     
     try:
-        conn = sqlite3.connect('attendance.db')
+        conn = connect_db()
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE users SET name = ?, username = ? WHERE user_id = ?",
@@ -386,7 +1930,7 @@ async def process_new_name(message: Message, state: FSMContext):
         conn.commit()
         conn.close()
         
-        ensure_user_in_excel(user_id, new_name, username)
+        await task_queue.run("interactive", ensure_user_in_excel, user_id, new_name, username)
         
         await message.answer(
             f"✅ Имя успешно изменено на: {new_name}",
@@ -398,101 +1942,636 @@ async def process_new_name(message: Message, state: FSMContext):
         await message.answer(f"❌ Ошибка при смене имени: {e}")
         await state.clear()
 
-@router.message(Command("history"))
-async def cmd_history(message: Message):
-    user_id = message.from_user.id
+@router.message(Command("remind"))
+async def cmd_remind(message: Message, state: FSMContext):
+    user_id = message.from_user.id
+    try:
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("SELECT reminder_time FROM users WHERE user_id = ?", (user_id,))
+        user = cursor.fetchone()
+        conn.close()
+    except Exception as e:
+        await message.answer(f"❌ Ошибка БД: {e}")
+        return
+    
+    if not user:
+        await message.answer("Сначала представьтесь! Нажмите /start")
+        return
+    
+    await message.answer(
+        f"⏰ Сейчас напоминание приходит в {user[0]} по МСК.\n\n"
+        f"Выбери новое время или введи своё (ЧЧ:ММ, с {REMINDER_EARLIEST} до 23:59):",
+        reply_markup=get_reminder_time_kb()
+    )
+    await state.set_state(AttendanceForm.waiting_for_reminder_time)
+
+@router.message(AttendanceForm.waiting_for_reminder_time)
+async def process_reminder_time(message: Message, state: FSMContext):
+    if message.text == "🚫 Отмена":
+        await message.answer("↩️ Отменено.", reply_markup=get_main_kb())
+        await state.clear()
+        return
+    
+    is_valid, result = validate_reminder_time(message.text or "")
+    if not is_valid:
+        await message.answer(f"❌ {result}\nПопробуй ещё:")
+        return
+    
+    try:
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("UPDATE users SET reminder_time = ? WHERE user_id = ?", (result, message.from_user.id))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        await message.answer(f"❌ Ошибка сохранения: {e}")
+        await state.clear()
+        return
+    
+    await message.answer(f"✅ Буду напоминать в {result} по МСК.", reply_markup=get_main_kb())
+    await state.clear()
+
+@router.message(Command("buckets"))
+async def cmd_buckets(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Эта команда только для админа!")
+        return
+    
+    try:
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT reminder_time, COUNT(*)
+            FROM users
+            GROUP BY reminder_time
+            ORDER BY reminder_time
+        """)
+        buckets = cursor.fetchall()
+        conn.close()
+    except Exception as e:
+        await message.answer(f"❌ Ошибка БД: {e}")
+        return
+    
+    if not buckets:
+        await message.answer("📭 Нет зарегистрированных пользователей.")
+        return
+    
+    total = sum(count for _, count in buckets)
+    peak = max(count for _, count in buckets)
+    text = "⏰ Напоминания по времени (МСК):\n\n"
+    for reminder_time, count in buckets:
+        text += f"• {reminder_time} — {count}\n"
+    text += f"\n👥 Всего: {total}, пик: {peak}"
+    await message.answer(text)
+
+@router.message(Command("holidays"))
+async def cmd_holidays(message: Message):
+    today_key = to_iso_key(datetime.now(TIMEZONE).strftime("%d.%m.%Y"))
+    upcoming = [
+        holiday for holiday in school_calendar.holidays
+        if to_iso_key(holiday[2]) >= today_key
+    ]
+    
+    if not upcoming:
+        await message.answer("📭 Ближайших праздников и каникул нет.")
+        return
+    
+    text = "🎉 Праздники и каникулы:\n\n"
+    for holiday_id, start_date, end_date, title in upcoming:
+        period = start_date if start_date == end_date else f"{start_date} — {end_date}"
+        text += f"#{holiday_id} 📆 {period}\n📝 {title}\n\n"
+    await message.answer(text)
+
+@router.message(Command("holiday"))
+async def cmd_holiday(message: Message, command: CommandObject):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Эта команда только для админа!")
+        return
+    
+    usage = (
+        "Использование:\n"
+        "/holiday ДД.ММ.ГГГГ Название\n"
+        "/holiday ДД.ММ.ГГГГ ДД.ММ.ГГГГ Название"
+    )
+    parts = (command.args or "").split()
+    if not parts:
+        await message.answer(usage)
+        return
+    
+    is_valid, start_date = validate_and_normalize_date(parts[0])
+    if not is_valid:
+        await message.answer(f"❌ {start_date}\n\n{usage}")
+        return
+    
+    end_date = start_date
+    title_parts = parts[1:]
+    if title_parts:
+        is_valid, result = validate_and_normalize_date(title_parts[0])
+        if is_valid:
+            end_date = result
+            title_parts = title_parts[1:]
+    
+    if to_iso_key(end_date) < to_iso_key(start_date):
+        await message.answer("❌ Дата окончания не может быть раньше даты начала!")
+        return
+    
+    title = " ".join(title_parts) or "Выходной"
+    try:
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO holidays (start_date, end_date, title) VALUES (?, ?, ?)",
+            (start_date, end_date, title)
+        )
+        conn.commit()
+        conn.close()
+        school_calendar.load_holidays()
+    except Exception as e:
+        await message.answer(f"❌ Ошибка сохранения: {e}")
+        return
+    
+    period = start_date if start_date == end_date else f"с {start_date} по {end_date}"
+    await message.answer(f"✅ Добавлено: {title} ({period}).\nНапоминания в эти дни не придут.")
+
+@router.message(Command("del_holiday"))
+async def cmd_del_holiday(message: Message, command: CommandObject):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Эта команда только для админа!")
+        return
+    
+    holiday_id = (command.args or "").strip().lstrip('#')
+    if not holiday_id.isdigit():
+        await message.answer("Использование: /del_holiday <номер из /holidays>")
+        return
+    
+    try:
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM holidays WHERE id = ?", (int(holiday_id),))
+        deleted = cursor.rowcount
+        conn.commit()
+        conn.close()
+        school_calendar.load_holidays()
+    except Exception as e:
+        await message.answer(f"❌ Ошибка удаления: {e}")
+        return
+    
+    if deleted:
+        await message.answer(f"✅ Праздник #{holiday_id} удалён.")
+    else:
+        await message.answer(f"📭 Праздник #{holiday_id} не найден.")
+
+@router.message(Command("history"))
+async def cmd_history(message: Message):
+    user_id = message.from_user.id
+    try:
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute("SELECT date, reason FROM absences WHERE user_id = ? ORDER BY rowid DESC LIMIT 10", (user_id,))
+        absences = cursor.fetchall()
+        conn.close()
+    except Exception as e:
+        await message.answer(f"❌ Ошибка БД: {e}")
+        return
+
+    if not absences:
+        await message.answer("📭 Нет записанных отсутствий.")
+        return
+
+    text = "📊 История отсутствий:\n\n"
+    for date, reason in absences:
+        reason_str = f" — {reason}" if reason else ""
+        text += f"• {date}{reason_str}\n"
+    await message.answer(text)
+
+@router.message(Command("absence"))
+async def cmd_absence(message: Message):
+    user_id = message.from_user.id
+    try:
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT start_date, end_date, reason
+            FROM absence_periods
+            WHERE user_id = ? AND {sql_iso_date('end_date')} >= ?
+            ORDER BY {sql_iso_date('start_date')}
+        """, (user_id, to_iso_key(datetime.now(TIMEZONE).strftime("%d.%m.%Y"))))
+        periods = cursor.fetchall()
+        conn.close()
+        
+        if not periods:
+            await message.answer("📭 У вас нет активных периодов отсутствия.")
+            return
+        
+        text = "📅 Активные периоды отсутствия:\n\n"
+        for start_date, end_date, reason in periods:
+            text += f"📆 С {start_date} по {end_date}\n📝 {reason}\n\n"
+        
+        text += "💡 Чтобы удалить период, отправьте /clear_absence"
+        await message.answer(text)
+        
+    except Exception as e:
+        await message.answer(f"❌ Ошибка: {e}")
+
+@router.message(Command("clear_absence"))
+async def cmd_clear_absence(message: Message):
+    user_id = message.from_user.id
+    today = datetime.now(TIMEZONE).strftime("%d.%m.%Y")
+    try:
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT id, start_date, end_date, reason FROM absence_periods
+            WHERE user_id = ? AND {sql_iso_date('end_date')} >= ?
+        """, (user_id, to_iso_key(today)))
+        periods = cursor.fetchall()
+        for period_id, start_date, end_date, reason in periods:
+            cursor.execute("DELETE FROM absence_periods WHERE id = ?", (period_id,))
+            append_event(cursor, "period_del", user_id, start_date, end_date, reason=reason, ref_id=period_id)
+        conn.commit()
+        conn.close()
+        deleted = len(periods)
+        
+        stale_cells = []
+        for _, start_date, end_date, reason in periods:
+            first_day = max(as_date(start_date), as_date(today))
+            for date_str in get_date_range(first_day, as_date(end_date)):
+                if is_mark_unchanged(user_id, date_str, "❌", reason):
+                    stale_cells.append((user_id, date_str))
+        
+        cleared = clear_marks(stale_cells)
+        for _, start_date, end_date, _ in periods:
+            attendance_matrix.refresh_period(user_id, start_date, end_date)
+        if cleared:
+            await task_queue.run("interactive", clear_journal_cells, cleared)
+        
+        if deleted > 0:
+            await message.answer(
+                f"✅ Удалено {deleted} активных периодов отсутствия.\n"
+                f"🧹 Снято отметок в журнале: {len(cleared)}"
+            )
+        else:
+            await message.answer("📭 Нет активных периодов для удаления.")
+            
+    except Exception as e:
+        await message.answer(f"❌ Ошибка удаления: {e}")
+
+@router.message(Command("journal"))
+async def cmd_journal(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Эта команда только для админа!")
+        return
+    
+    try:
+        content = await task_queue.run("reports", build_journal, key=f"journal:{current_group().group_id}")
+        document = BufferedInputFile(content, filename="Журнал_посещаемости.xlsx")
+        await message.answer_document(document, caption=f"📊 Актуальный журнал посещаемости: {current_group().title}")
+    except Exception as e:
+        await message.answer(f"❌ Ошибка отправки файла: {e}")
+        logger.exception("❌ Ошибка отправки журнала")
+
+def get_user_names(user_ids: list) -> dict:
+    if not user_ids:
+        return {}
+    conn = connect_db()
+    cursor = conn.cursor()
+    placeholders = ",".join("?" * len(user_ids))
+    cursor.execute(f"SELECT user_id, name FROM users WHERE user_id IN ({placeholders})", list(user_ids))
+    names = dict(cursor.fetchall())
+    conn.close()
+    return names
+
+@router.message(Command("absent"))
+async def cmd_absent(message: Message, command: CommandObject):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Эта команда только для админа!")
+        return
+    
+    if command.args:
+        is_valid, date_str = validate_and_normalize_date(command.args)
+        if not is_valid:
+            await message.answer(f"❌ {date_str}\nИспользование: /absent ДД.ММ.ГГГГ")
+            return
+    else:
+        date_str = datetime.now(TIMEZONE).strftime("%d.%m.%Y")
+    
+    absent_ids = attendance_matrix.users_with_status(date_str, "❌")
+    present_count = len(attendance_matrix.users_with_status(date_str, "✅"))
+    if not absent_ids:
+        await message.answer(f"📭 На {date_str} отсутствующих нет. Отметились «буду»: {present_count}")
+        return
+    
+    names = get_user_names(absent_ids)
+    text = f"❌ Отсутствуют {date_str} ({len(absent_ids)}):\n\n"
+    for user_id in absent_ids:
+        text += f"• {names.get(user_id, user_id)}\n"
+    text += f"\n✅ Отметились «буду»: {present_count}"
+    await message.answer(text)
+
+@router.message(Command("stats"))
+async def cmd_stats(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Эта команда только для админа!")
+        return
+    
+    today = datetime.now(TIMEZONE)
+    start = academic_year_start(today)
+    top = attendance_matrix.top_absentees(10, start, today)
+    daily = attendance_matrix.daily_absent_counts(start, today)
+    
+    if not top:
+        await message.answer(f"📭 С {start.strftime('%d.%m.%Y')} пропусков нет.")
+        return
+    
+    names = get_user_names([user_id for user_id, _ in top])
+    text = f"📊 Пропуски с {start.strftime('%d.%m.%Y')}:\n\n"
+    for user_id, count in top:
+        text += f"• {names.get(user_id, user_id)} — {count}\n"
+    text += (
+        f"\n📅 Учебных дней: {len(daily)}, всего пропусков: {int(daily.sum())}, "
+        f"в среднем за день: {daily.mean():.1f}"
+    )
+    await message.answer(text)
+
+def parse_roster(file_name: str, content: bytes) -> tuple[list, list]:
+    if file_name.lower().endswith(".xlsx"):
+        wb = load_workbook(io.BytesIO(content), read_only=True)
+        table = [[cell for cell in row] for row in wb.active.iter_rows(values_only=True)]
+        wb.close()
+    else:
+        try:
+            text = content.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            text = content.decode("cp1251")
+        try:
+            dialect = csv.Sniffer().sniff(text[:2048], delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        table = list(csv.reader(io.StringIO(text), dialect))
+    
+    if not table:
+        return [], ["Файл пустой"]
+    
+    header = [str(value or "").strip().lower() for value in table[0]]
+    columns = {}
+    for field, aliases in ROSTER_COLUMNS.items():
+        for index, title in enumerate(header):
+            if title in aliases:
+                columns[field] = index
+                break
+    if "user_id" not in columns or "name" not in columns:
+        return [], ["В первой строке нужны колонки user_id (или ID) и name (или Имя)"]
+    
+    rows, errors = [], []
+    for line_no, values in enumerate(table[1:], start=2):
+        values = list(values) + [None] * len(header)
+        raw_id = str(values[columns["user_id"]] or "").strip()
+        name = str(values[columns["name"]] or "").strip()
+        username = str(values[columns["username"]] or "").strip().lstrip('@') if "username" in columns else ""
+        if not raw_id and not name:
+            continue
+        if raw_id.endswith(".0"):
+            raw_id = raw_id[:-2]
+        if not raw_id.isdigit():
+            errors.append(f"строка {line_no}: некорректный ID «{raw_id}»")
+            continue
+        if len(name) < 2:
+            errors.append(f"строка {line_no}: слишком короткое имя")
+            continue
+        rows.append((int(raw_id), name, username or None))
+    return rows, errors
+
+def plan_roster_import(rows: list) -> dict:
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT user_id, name, username FROM users")
+    existing = {user_id: (name, username) for user_id, name, username in cursor.fetchall()}
+    conn.close()
+    
+    username_owner = {username.lower(): user_id for user_id, (_, username) in existing.items() if username}
+    elsewhere = group_registry.members_elsewhere([row[0] for row in rows], current_group().group_id)
+    plan = {"new": [], "update": [], "unchanged": 0, "conflicts": []}
+    seen_ids = set()
+    for user_id, name, username in rows:
+        if user_id in seen_ids:
+            plan["conflicts"].append(f"ID {user_id} встречается в файле несколько раз")
+            continue
+        seen_ids.add(user_id)
+        
+        if username:
+            owner = username_owner.get(username.lower())
+            if owner is not None and owner != user_id:
+                plan["conflicts"].append(f"@{username} уже занят пользователем ID {owner}")
+                continue
+            username_owner[username.lower()] = user_id
+        
+        if user_id in elsewhere:
+            plan["conflicts"].append(f"ID {user_id} будет переведён из группы «{elsewhere[user_id].title}»")
+        
+        if user_id not in existing:
+            plan["new"].append((user_id, name, username))
+            continue
+        
+        old_name, old_username = existing[user_id]
+        username = username or old_username
+        if (old_name, old_username) == (name, username):
+            plan["unchanged"] += 1
+        else:
+            plan["update"].append((user_id, name, username))
+            plan["conflicts"].append(f"ID {user_id}: «{old_name}» → «{name}»")
+    return plan
+
+def apply_roster_import(users: list) -> tuple[int, bool]:
+    group = current_group()
+    conn = connect_db()
+    try:
+        with conn:
+            conn.executemany('''
+                INSERT INTO users (user_id, name, username, reminder_time) VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET name = excluded.name, username = excluded.username
+            ''', [(*user, group.reminder_time) for user in users])
+    finally:
+        conn.close()
+    group_registry.assign([user[0] for user in users], group.group_id)
+    return len(users), ensure_users_in_excel(users)
+
+@router.message(Command("import_roster"))
+async def cmd_import_roster(message: Message, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Эта команда только для админа!")
+        return
+    
+    await message.answer(
+        "📥 Пришли файл со списком группы (CSV или XLSX).\n\n"
+        "Первая строка — заголовки: user_id (или ID), name (или Имя), username (необязательно).\n"
+        "Файл из /export_roster и Excel-журнал подходят как есть.",
+        reply_markup=get_cancel_kb()
+    )
+    await state.set_state(AttendanceForm.waiting_for_roster)
+
+@router.message(AttendanceForm.waiting_for_roster)
+async def process_roster_file(message: Message, state: FSMContext):
+    if message.text == "🚫 Отмена":
+        await message.answer("↩️ Отменено.", reply_markup=get_main_kb())
+        await state.clear()
+        return
+    
+    document = message.document
+    if not document or not (document.file_name or "").lower().endswith((".csv", ".xlsx")):
+        await message.answer("❌ Нужен файл .csv или .xlsx. Попробуй ещё:")
+        return
+    if document.file_size and document.file_size > ROSTER_MAX_BYTES:
+        await message.answer("❌ Файл слишком большой (максимум 1 МБ).")
+        return
+    
+    try:
+        buffer = io.BytesIO()
+        await bot.download(document, destination=buffer)
+        rows, errors = parse_roster(document.file_name, buffer.getvalue())
+        plan = plan_roster_import(rows)
+    except Exception as e:
+        logger.exception("❌ Ошибка разбора списка группы: %s", e)
+        await message.answer(f"❌ Не удалось прочитать файл: {e}")
+        return
+    
+    to_apply = plan["new"] + plan["update"]
+    text = (
+        f"🧪 Пробный импорт: {document.file_name}\n\n"
+        f"➕ Новых: {len(plan['new'])}\n"
+        f"✏️ Изменений: {len(plan['update'])}\n"
+        f"⏸ Без изменений: {plan['unchanged']}\n"
+        f"⚠️ Ошибок в строках: {len(errors)}\n"
+    )
+    details = [f"⚠️ {conflict}" for conflict in plan["conflicts"]] + [f"❌ {error}" for error in errors]
+    if details:
+        text += "\n" + "\n".join(details[:30])
+        if len(details) > 30:
+            text += f"\n… и ещё {len(details) - 30}"
+    
+    if not to_apply:
+        await message.answer(text + "\n\n📭 Применять нечего.", reply_markup=get_main_kb())
+        await state.clear()
+        return
+    
+    await state.update_data(roster=[list(user) for user in to_apply])
+    await state.set_state(AttendanceForm.waiting_for_roster_confirm)
+    await message.answer(
+        text[:TELEGRAM_MESSAGE_LIMIT - 100],
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text=f"✅ Применить ({len(to_apply)})", callback_data=RosterCallback(action="apply").pack()),
+            InlineKeyboardButton(text="🚫 Отмена", callback_data=RosterCallback(action="cancel").pack())
+        ]])
+    )
+
+@router.callback_query(RosterCallback.filter(), AttendanceForm.waiting_for_roster_confirm)
+async def process_roster_confirm(callback: CallbackQuery, callback_data: RosterCallback, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Только для админа!", show_alert=True)
+        return
+    
+    data = await state.get_data()
+    await state.clear()
+    if callback_data.action != "apply":
+        await callback.answer("↩️ Отменено")
+        await callback.message.edit_text(f"{callback.message.text}\n\n↩️ Импорт отменён")
+        return
+    
+    users = [tuple(user) for user in data.get("roster", [])]
     try:
-        conn = sqlite3.connect('attendance.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT date, reason FROM absences WHERE user_id = ? ORDER BY rowid DESC LIMIT 10", (user_id,))
-        absences = cursor.fetchall()
-        conn.close()
+        started = time.perf_counter()
+        imported, journal_updated = await task_queue.run("reports", apply_roster_import, users)
     except Exception as e:
-        await message.answer(f"❌ Ошибка БД: {e}")
+        logger.exception("❌ Ошибка импорта списка группы: %s", e)
+        await callback.answer(f"❌ Ошибка импорта: {e}", show_alert=True)
         return
-
-    if not absences:
-        await message.answer("📭 Нет записанных отсутствий.")
+    
+    logger.info(
+        "✅ Импортировано пользователей: %s", imported,
+        extra={"handler": "process_roster_confirm", "duration_ms": round((time.perf_counter() - started) * 1000, 1)}
+    )
+    if not journal_updated:
+        await callback.answer("⚠️ Журнал не обновлён", show_alert=True)
+        await callback.message.edit_text(
+            f"{callback.message.text}\n\n✅ Импортировано в базу: {imported}\n"
+            f"⚠️ Строки в Excel-журнал не записаны, подробности в логах"
+        )
         return
+    await callback.answer("✅ Готово")
+    await callback.message.edit_text(f"{callback.message.text}\n\n✅ Импортировано: {imported}")
 
-    text = "📊 История отсутствий:\n\n"
-    for date, reason in absences:
-        reason_str = f" — {reason}" if reason else ""
-        text += f"• {date}{reason_str}\n"
-    await message.answer(text)
-
-@router.message(Command("absence"))
-async def cmd_absence(message: Message):
-    user_id = message.from_user.id
+@router.message(Command("export_roster"))
+async def cmd_export_roster(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Эта команда только для админа!")
+        return
+    
     try:
-        conn = sqlite3.connect('attendance.db')
+        conn = connect_db()
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT start_date, end_date, reason 
-            FROM absence_periods 
-            WHERE user_id = ? AND end_date >= ?
-            ORDER BY start_date
-        """, (user_id, datetime.now().strftime("%d.%m.%Y")))
-        periods = cursor.fetchall()
+        cursor.execute("SELECT user_id, name, username, reminder_time FROM users ORDER BY name")
+        users = cursor.fetchall()
         conn.close()
-        
-        if not periods:
-            await message.answer("📭 У вас нет активных периодов отсутствия.")
-            return
-        
-        text = "📅 Активные периоды отсутствия:\n\n"
-        for start_date, end_date, reason in periods:
-            text += f"📆 С {start_date} по {end_date}\n📝 {reason}\n\n"
-        
-        text += "💡 Чтобы удалить период, отправьте /clear_absence"
-        await message.answer(text)
-        
     except Exception as e:
-        await message.answer(f"❌ Ошибка: {e}")
+        await message.answer(f"❌ Ошибка БД: {e}")
+        return
+    
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["user_id", "name", "username", "reminder_time"])
+    writer.writerows((user_id, name, username or "", reminder_time) for user_id, name, username, reminder_time in users)
+    document = BufferedInputFile(output.getvalue().encode("utf-8-sig"), filename="Список_группы.csv")
+    await message.answer_document(document, caption=f"👥 Список группы: {len(users)} человек")
 
-@router.message(Command("clear_absence"))
-async def cmd_clear_absence(message: Message):
-    user_id = message.from_user.id
+@router.message(Command("reconcile"))
+async def cmd_reconcile(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Эта команда только для админа!")
+        return
+    
     try:
-        conn = sqlite3.connect('attendance.db')
-        cursor = conn.cursor()
-        cursor.execute("""
-            DELETE FROM absence_periods 
-            WHERE user_id = ? AND end_date >= ?
-        """, (user_id, datetime.now().strftime("%d.%m.%Y")))
-        deleted = cursor.rowcount
-        conn.commit()
-        conn.close()
-        
-        if deleted > 0:
-            await message.answer(f"✅ Удалено {deleted} активных периодов отсутствия.")
-        else:
-            await message.answer("📭 Нет активных периодов для удаления.")
-            
+        seq, written = await task_queue.run("reports", reconcile_journal, key=f"reconcile:{current_group().group_id}")
     except Exception as e:
-        await message.answer(f"❌ Ошибка удаления: {e}")
+        logger.exception("❌ Ошибка сверки журнала: %s", e)
+        await message.answer(f"❌ Ошибка сверки журнала: {e}")
+        return
+    
+    await message.answer(f"✅ Журнал сверен с журналом событий (seq {seq}), обновлено ячеек: {written}")
 
-@router.message(Command("journal"))
-async def cmd_journal(message: Message):
-    if message.from_user.id != ADMIN_CHAT_ID:
+@router.message(Command("journal_at"))
+async def cmd_journal_at(message: Message, command: CommandObject):
+    if not is_admin(message.from_user.id):
         await message.answer("❌ Эта команда только для админа!")
         return
     
+    usage = "Использование: /journal_at ДД.ММ.ГГГГ [ЧЧ:ММ]"
+    parts = (command.args or "").split()
+    if not parts:
+        await message.answer(usage)
+        return
+    
+    is_valid, date_str = validate_and_normalize_date(parts[0])
+    if not is_valid:
+        await message.answer(f"❌ {date_str}\n{usage}")
+        return
+    
+    time_str = parts[1] if len(parts) > 1 else "23:59"
     try:
-        if not os.path.exists(EXCEL_FILE):
-            init_excel()
-        else:
-            wb = load_workbook(EXCEL_FILE)
-            ws = wb.active
-            ensure_dates_in_excel(ws, datetime.now(), 30)
-            wb.save(EXCEL_FILE)
-        
-        document = FSInputFile(EXCEL_FILE, filename="Журнал_посещаемости.xlsx")
-        await message.answer_document(document, caption="📊 Актуальный журнал посещаемости")
+        point = datetime.strptime(f"{date_str} {time_str}", "%d.%m.%Y %H:%M").replace(tzinfo=TIMEZONE)
+    except ValueError:
+        await message.answer(f"❌ Некорректное время\n{usage}")
+        return
+    
+    max_ts = int(point.timestamp())
+    try:
+        content, seq = await task_queue.run(
+            "reports", build_journal_at, max_ts, key=f"journal_at:{current_group().group_id}:{max_ts}"
+        )
+        document = BufferedInputFile(content, filename=f"Журнал_на_{point.strftime('%d.%m.%Y_%H-%M')}.xlsx")
+        await message.answer_document(document, caption=f"🕰 Журнал на {date_str} {time_str} (seq {seq})")
     except Exception as e:
-        await message.answer(f"❌ Ошибка отправки файла: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Ошибка восстановления журнала: %s", e)
+        await message.answer(f"❌ Ошибка восстановления журнала: {e}")
 
 @router.message(Command("support"))
 async def cmd_support(message: Message):
@@ -507,7 +2586,7 @@ async def cmd_support(message: Message):
 
 @router.message(Command("duty"))
 async def cmd_duty(message: Message, state: FSMContext):
-    if message.from_user.id != ADMIN_CHAT_ID:
+    if not is_admin(message.from_user.id):
         await message.answer("❌ Эта команда только для админа!")
         return
     
@@ -519,7 +2598,7 @@ async def cmd_duty(message: Message, state: FSMContext):
 
 @router.message(AttendanceForm.waiting_for_duty_usernames)
 async def process_duty_usernames(message: Message, state: FSMContext):
-    if message.from_user.id != ADMIN_CHAT_ID:
+    if not is_admin(message.from_user.id):
         await message.answer("❌ Эта команда только для админа!")
         return
     
@@ -540,26 +2619,38 @@ async def process_duty_usernames(message: Message, state: FSMContext):
         return
     
     try:
-        conn = sqlite3.connect('attendance.db')
+        conn = connect_db()
         cursor = conn.cursor()
+        placeholders = ",".join("?" * len(input_usernames))
+        cursor.execute(
+            f"SELECT user_id, name, username FROM users WHERE username COLLATE NOCASE IN ({placeholders})",
+            input_usernames
+        )
+        exact = {username.lower(): (user_id, name, username) for user_id, name, username in cursor.fetchall()}
+        conn.close()
         
         assigned_users = []
-        not_found = []
-        
+        fuzzy_matches = []
+        missing = []
         for username in input_usernames:
-            cursor.execute(
-                "SELECT user_id, name FROM users WHERE username = ?",
-                (username,)
-            )
-            result = cursor.fetchone()
-            
-            if result:
-                user_id, name = result
-                assigned_users.append((user_id, name, username))
+            if username.lower() in exact:
+                assigned_users.append(exact[username.lower()])
             else:
-                not_found.append(username)
+                missing.append(username)
         
-        conn.close()
+        not_found = []
+        if missing:
+            suggestions = search_users_batch(missing, limit=2)
+            for username in missing:
+                ranked = suggestions.get(username.lower(), [])
+                best = ranked[0] if ranked else None
+                is_clear = best and (len(ranked) == 1 or ranked[1][0] < best[0])
+                if best and best[0] >= FUZZY_MATCH_THRESHOLD and is_clear:
+                    _, user_id, name, matched_username = best
+                    assigned_users.append((user_id, name, matched_username))
+                    fuzzy_matches.append((username, name, matched_username))
+                else:
+                    not_found.append(username)
         
         success_count = 0
         for user_id, name, username in assigned_users:
@@ -571,14 +2662,21 @@ async def process_duty_usernames(message: Message, state: FSMContext):
                 )
                 success_count += 1
             except Exception as e:
-                print(f"⚠️ Не удалось отправить сообщение {username}: {e}")
+                logger.warning("⚠️ Не удалось отправить сообщение %s: %s", username, e)
         
         response = "✅ Дежурные назначены!\n\n"
         
         if assigned_users:
             response += "📨 Уведомления отправлены:\n"
             for _, name, username in assigned_users:
-                response += f"• {name} (@{username})\n"
+                username_display = f" (@{username})" if username else ""
+                response += f"• {name}{username_display}\n"
+        
+        if fuzzy_matches:
+            response += "\n🔎 Найдены по похожему написанию:\n"
+            for query, name, username in fuzzy_matches:
+                username_display = f"@{username}" if username else name
+                response += f"• {query} → {username_display}\n"
         
         if not_found:
             response += "\n❌ Не найдены в базе:\n"
@@ -592,13 +2690,125 @@ async def process_duty_usernames(message: Message, state: FSMContext):
         await message.answer(f"❌ Ошибка при назначении дежурных: {e}")
         await state.clear()
 
-@router.message(Command("start"))
-async def cmd_start(message: Message, state: FSMContext):
+@router.message(Command("find"))
+async def cmd_find(message: Message, command: CommandObject):
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ Эта команда только для админа!")
+        return
+    
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer("Использование: /find имя или @юзернейм (можно с опечатками)")
+        return
+    
+    try:
+        results = [result for result in search_users(query, limit=10) if result[0] >= 0.3]
+    except Exception as e:
+        await message.answer(f"❌ Ошибка поиска: {e}")
+        return
+    
+    if not results:
+        await message.answer(f"📭 По запросу «{query}» никого не нашёл.")
+        return
+    
+    text = f"🔎 Результаты по «{query}»:\n\n"
+    for score, user_id, name, username in results:
+        username_display = f" (@{username})" if username else ""
+        text += f"• {name}{username_display} — ID {user_id} ({round(score * 100)}%)\n"
+    await message.answer(text)
+
+@router.message(Command("groups"))
+async def cmd_groups(message: Message):
+    if message.from_user.id != ADMIN_CHAT_ID:
+        await message.answer("❌ Эта команда только для главного админа!")
+        return
+    
+    bot_info = await bot.get_me()
+    text = "👥 Группы:\n\n"
+    for group in group_registry.all():
+        try:
+            with group_context(group):
+                conn = connect_db()
+                cursor = conn.cursor()
+                cursor.execute("SELECT COUNT(*) FROM users")
+                members = cursor.fetchone()[0]
+                conn.close()
+        except sqlite3.Error:
+            members = "?"
+        text += (
+            f"• {group.title} ({group.group_id}) — админ {group.admin_chat_id}, "
+            f"студентов {members}, напоминание {group.reminder_time}\n"
+            f"  https://t.me/{bot_info.username}?start={group.join_code}\n"
+        )
+    await message.answer(text, disable_web_page_preview=True)
+
+@router.message(Command("new_group"))
+async def cmd_new_group(message: Message, command: CommandObject):
+    if message.from_user.id != ADMIN_CHAT_ID:
+        await message.answer("❌ Эта команда только для главного админа!")
+        return
+    
+    usage = "Использование: /new_group ID_админа [ЧЧ:ММ] Название группы"
+    parts = (command.args or "").split(maxsplit=1)
+    if len(parts) < 2 or not parts[0].lstrip("-").isdigit():
+        await message.answer(usage)
+        return
+    
+    admin_chat_id = int(parts[0])
+    title = parts[1].strip()
+    reminder_time = DEFAULT_REMINDER_TIME
+    time_parts = title.split(maxsplit=1)
+    if len(time_parts) == 2 and ":" in time_parts[0]:
+        is_valid, result = validate_reminder_time(time_parts[0])
+        if not is_valid:
+            await message.answer(f"❌ {result}\n{usage}")
+            return
+        reminder_time, title = result, time_parts[1]
+    
+    try:
+        group = group_registry.create(admin_chat_id, title, reminder_time)
+        with group_context(group):
+            init_group_storage()
+    except Exception as e:
+        logger.exception("❌ Ошибка создания группы: %s", e)
+        await message.answer(f"❌ Ошибка создания группы: {e}")
+        return
+    
+    bot_info = await bot.get_me()
+    await message.answer(
+        f"✅ Группа «{group.title}» создана ({group.group_id}).\n"
+        f"👤 Админ: {admin_chat_id}\n"
+        f"⏰ Напоминание по умолчанию: {reminder_time}\n\n"
+        f"🔗 Ссылка для студентов: https://t.me/{bot_info.username}?start={group.join_code}\n"
+        f"или команда: /join {group.join_code}",
+        disable_web_page_preview=True
+    )
+
+@router.message(Command("start", "join"))
+async def cmd_start(message: Message, state: FSMContext, command: CommandObject):
     user_id = message.from_user.id
     username = message.from_user.username
     
+    if command.command == "join" and not command.args:
+        await message.answer("Использование: /join код_группы")
+        return
+    
+    if command.args:
+        group = group_registry.by_join_code(command.args.strip())
+        if group is None:
+            await message.answer("❌ Неизвестный код группы. Проверь ссылку у старосты.")
+            return
+        try:
+            group_registry.assign([user_id], group.group_id)
+        except Exception as e:
+            await message.answer(f"❌ Ошибка базы данных: {e}")
+            return
+        current_group_var.set(group)
+        await state.clear()
+        await message.answer(f"🎓 Ты в группе «{group.title}»")
+    
     try:
-        conn = sqlite3.connect('attendance.db')
+        conn = connect_db()
         cursor = conn.cursor()
         cursor.execute("SELECT name, username FROM users WHERE user_id = ?", (user_id,))
         user = cursor.fetchone()
@@ -629,7 +2839,7 @@ async def cmd_start(message: Message, state: FSMContext):
 async def handle_buttons(message: Message, state: FSMContext):
     user_id = message.from_user.id
     try:
-        conn = sqlite3.connect('attendance.db')
+        conn = connect_db()
         cursor = conn.cursor()
         cursor.execute("SELECT name FROM users WHERE user_id = ?", (user_id,))
         user = cursor.fetchone()
@@ -640,8 +2850,9 @@ async def handle_buttons(message: Message, state: FSMContext):
             return
             
         if message.text == "📝 Отметиться":
+            target_date = school_calendar.next_school_day(datetime.now(TIMEZONE))
             await message.answer(
-                "Выбери свой статус на завтра:",
+                f"Выбери свой статус на {target_date}:",
                 reply_markup=ReplyKeyboardMarkup(
                     keyboard=[
                         [KeyboardButton(text="✅ Буду"), KeyboardButton(text="❌ Не буду")]
@@ -673,12 +2884,15 @@ async def process_name(message: Message, state: FSMContext):
     username = message.from_user.username or (await state.get_data()).get("username")
     
     try:
-        conn = sqlite3.connect('attendance.db')
+        conn = connect_db()
         cursor = conn.cursor()
-        cursor.execute("INSERT OR REPLACE INTO users (user_id, name, username) VALUES (?, ?, ?)", (user_id, name, username))
+        cursor.execute('''
+            INSERT INTO users (user_id, name, username, reminder_time) VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET name = excluded.name, username = excluded.username
+        ''', (user_id, name, username, current_group().reminder_time))
         conn.commit()
         conn.close()
-        ensure_user_in_excel(user_id, name, username)
+        await task_queue.run("interactive", ensure_user_in_excel, user_id, name, username)
     except Exception as e:
         await message.answer(f"❌ Ошибка сохранения: {e}")
         return
@@ -691,15 +2905,11 @@ async def process_name(message: Message, state: FSMContext):
 
 @router.message(AttendanceForm.waiting_for_attendance)
 async def process_attendance(message: Message, state: FSMContext):
-    current_weekday = datetime.now().weekday()
-    if current_weekday == 6:
-        target_date = (datetime.now() + timedelta(days=1)).strftime("%d.%m.%Y")
-    else:
-        target_date = (datetime.now() + timedelta(days=1)).strftime("%d.%m.%Y")
+    target_date = school_calendar.next_school_day(datetime.now(TIMEZONE))
     
     if message.text == "✅ Буду":
         user_id = message.from_user.id
-        update_attendance_in_excel(user_id, target_date, "✅")
+        await task_queue.run("interactive", update_attendance_in_excel, user_id, target_date, "✅")
         await message.answer("👍 Отлично! Хороших пар! 📚", reply_markup=get_main_kb())
         await state.clear()
         return
@@ -737,48 +2947,107 @@ async def process_date(message: Message, state: FSMContext):
 
 @router.message(AttendanceForm.waiting_for_reason)
 async def process_reason(message: Message, state: FSMContext):
+    user_id = message.from_user.id
+    data = await state.get_data()
+    date = data['date']
+    
     if message.text == "🚫 Отмена":
+        if data.get("reminder_message_id"):
+            await edit_reminder_result(
+                user_id, data["reminder_message_id"], data.get("reminder_text", ""),
+                "Ответ отменён", keep_keyboard_for=date
+            )
         await message.answer("↩️ Отменено.", reply_markup=get_main_kb())
         await state.clear()
         return
     
     reason = None if message.text.strip() in ["-", ""] else message.text.strip()
-    user_id = message.from_user.id
-    data = await state.get_data()
-    date = data['date']
+    
+    if is_mark_unchanged(user_id, date, "❌", reason):
+        await message.answer(f"👌 Отсутствие на {date} уже записано.", reply_markup=get_main_kb())
+        await state.clear()
+        return
     
     try:
-        conn = sqlite3.connect('attendance.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT name, username FROM users WHERE user_id = ?", (user_id,))
-        user_row = cursor.fetchone()
+        if not await task_queue.run("interactive", update_attendance_in_excel, user_id, date, "❌", reason):
+            await message.answer("❌ Не удалось записать отметку в журнал. Попробуй позже.", reply_markup=get_main_kb())
+            await state.clear()
+            return
+        user_row = record_absence(user_id, date, reason)
         if not user_row:
-            conn.close()
             await message.answer("❌ Ошибка: пользователь не найден в базе.")
             await state.clear()
             return
-        
-        user_name, user_username = user_row
-        cursor.execute("INSERT INTO absences (user_id, date, reason) VALUES (?, ?, ?)", (user_id, date, reason))
-        conn.commit()
-        conn.close()
     except Exception as e:
         await message.answer(f"❌ Ошибка сохранения: {e}")
         await state.clear()
         return
     
-    update_attendance_in_excel(user_id, date, "❌", reason)
+    user_name, user_username = user_row
+    await notify_admin_absence(user_id, user_name, user_username, date, reason)
     
-    username_display = f" (@{user_username})" if user_username else ""
-    reason_text = f"\n📝 Причина: {reason}" if reason else ""
-    await bot.send_message(
-        ADMIN_CHAT_ID,
-        f"⚠️ Отсутствие\n👤 {user_name}{username_display} (ID: {user_id})\n📅 {date}{reason_text}"
-    )
+    if data.get("reminder_message_id"):
+        reason_text = f" ({reason})" if reason else ""
+        await edit_reminder_result(
+            user_id, data["reminder_message_id"], data.get("reminder_text", ""),
+            f"Отмечено: не буду{reason_text}", keep_keyboard_for=date
+        )
     
     await message.answer(f"✅ Записал отсутствие на {date}.", reply_markup=get_main_kb())
     await state.clear()
 
+@router.callback_query(MarkCallback.filter())
+async def process_mark_callback(callback: CallbackQuery, callback_data: MarkCallback, state: FSMContext):
+    user_id = callback.from_user.id
+    date = callback_data.date
+    message_id = callback.message.message_id if callback.message else None
+    reminder_text = (callback.message.text or "") if callback.message else ""
+    
+    if not is_markable_date(date):
+        await callback.answer("❌ На эту дату отметиться нельзя.", show_alert=True)
+        return
+    
+    if callback_data.action == "present":
+        if not is_mark_unchanged(user_id, date, "✅"):
+            if not await task_queue.run("interactive", update_attendance_in_excel, user_id, date, "✅"):
+                await callback.answer("❌ Не удалось записать отметку. Если вы ещё не представились — нажмите /start", show_alert=True)
+                return
+        await callback.answer("👍 Отлично! Хороших пар! 📚")
+        if message_id:
+            await edit_reminder_result(user_id, message_id, reminder_text, "Отмечено: буду ✅", keep_keyboard_for=date)
+        return
+    
+    if callback_data.action == "absent":
+        if not is_mark_unchanged(user_id, date, "❌"):
+            if not await task_queue.run("interactive", update_attendance_in_excel, user_id, date, "❌"):
+                await callback.answer("❌ Не удалось записать отметку. Если вы ещё не представились — нажмите /start", show_alert=True)
+                return
+            try:
+                user_row = record_absence(user_id, date)
+            except Exception as e:
+                await callback.answer(f"❌ Ошибка сохранения: {e}", show_alert=True)
+                return
+            if not user_row:
+                await callback.answer("Сначала представьтесь! Нажмите /start", show_alert=True)
+                return
+            await notify_admin_absence(user_id, user_row[0], user_row[1], date)
+        
+        await callback.answer(f"✅ Записал отсутствие на {date}.")
+        if message_id:
+            await edit_reminder_result(user_id, message_id, reminder_text, "Отмечено: не буду ❌", keep_keyboard_for=date)
+        return
+    
+    if callback_data.action == "reason":
+        await state.set_state(AttendanceForm.waiting_for_reason)
+        await state.update_data(date=date, reminder_message_id=message_id, reminder_text=reminder_text)
+        await callback.answer()
+        if message_id:
+            await edit_reminder_result(user_id, message_id, reminder_text, "Жду причину отсутствия…")
+        await bot.send_message(user_id, "✏️ Причина отсутствия? Напиши «-» если нет:", reply_markup=get_cancel_kb())
+        return
+    
+    await callback.answer()
+
 @router.message(AttendanceForm.waiting_for_start_date)
 async def process_start_date(message: Message, state: FSMContext):
     if message.text == "🚫 Отмена":
@@ -841,7 +3110,7 @@ async def process_absence_reason(message: Message, state: FSMContext):
     end_date = data['end_date']
     
     try:
-        conn = sqlite3.connect('attendance.db')
+        conn = connect_db()
         cursor = conn.cursor()
         cursor.execute("SELECT name, username FROM users WHERE user_id = ?", (user_id,))
         user_row = cursor.fetchone()
@@ -852,20 +3121,21 @@ async def process_absence_reason(message: Message, state: FSMContext):
             return
         
         user_name, user_username = user_row
+        date_range = get_date_range(
+            datetime.strptime(start_date, "%d.%m.%Y"),
+            datetime.strptime(end_date, "%d.%m.%Y")
+        )
         cursor.execute(
             "INSERT INTO absence_periods (user_id, start_date, end_date, reason) VALUES (?, ?, ?, ?)",
             (user_id, start_date, end_date, reason)
         )
+        append_event(cursor, "period_add", user_id, start_date, end_date, reason=reason, ref_id=cursor.lastrowid)
         conn.commit()
         conn.close()
         
-        date_range = get_date_range(
-            datetime.strptime(start_date, "%d.%m.%Y"),
-            datetime.strptime(end_date, "%d.%m.%Y")
-        )
-        
         for date_str in date_range:
-            update_attendance_in_excel(user_id, date_str, "❌", reason)
+            await task_queue.run("interactive", update_attendance_in_excel, user_id, date_str, "❌", reason)
+        attendance_matrix.refresh_period(user_id, start_date, end_date)
         
         username_display = f" (@{user_username})" if user_username else ""
         admin_message = (
@@ -874,7 +3144,7 @@ async def process_absence_reason(message: Message, state: FSMContext):
             f"📆 С {start_date} по {end_date}\n"
             f"📝 Причина: {reason}"
         )
-        await bot.send_message(ADMIN_CHAT_ID, admin_message)
+        await admin_digest.add(admin_message, urgent=is_today_or_past(start_date))
         
         await message.answer(
             f"✅ Записал период отсутствия:\n"
@@ -889,117 +3159,247 @@ async def process_absence_reason(message: Message, state: FSMContext):
         await message.answer(f"❌ Ошибка сохранения периода: {e}")
         await state.clear()
 
-async def send_daily_reminder(bot: Bot):
+async def send_daily_reminder(bot: Bot, reminder_time: str = None):
+    started = time.perf_counter()
     try:
-        current_weekday = datetime.now().weekday()
-        
-        days_to_ask = {
-            0: "вторник",
-            1: "среду",
-            2: "четверг",
-            3: "пятницу",
-            4: "субботу",
-            6: "понедельник"
-        }
+        tomorrow_dt = datetime.now(TIMEZONE) + timedelta(days=1)
+        tomorrow = tomorrow_dt.strftime("%d.%m.%Y")
         
-        if current_weekday == 5:
-            print("⏭️ Сегодня суббота — напоминание не отправляется")
-            return
-            
-        if current_weekday not in days_to_ask:
-            print(f"⏭️ Сегодня {current_weekday}-й день недели — напоминание не требуется")
+        if not school_calendar.is_school_day(tomorrow_dt):
+            if reminder_time is None:
+                reason = school_calendar.closed_reason(tomorrow) or "выходной"
+                logger.info("⏭️ Завтра (%s) не учебный день: %s — напоминание не требуется", tomorrow, reason)
             return
         
-        day_name = days_to_ask[current_weekday]
-        tomorrow = (datetime.now() + timedelta(days=1)).strftime("%d.%m.%Y")
+        day_name = WEEKDAY_NAMES_ACC[tomorrow_dt.weekday()]
         
-        conn = sqlite3.connect('attendance.db')
+        conn = connect_db()
         cursor = conn.cursor()
-        cursor.execute("SELECT user_id, name, username FROM users")
+        if reminder_time is None:
+            cursor.execute("SELECT user_id, name, username FROM users")
+        else:
+            cursor.execute("SELECT user_id, name, username FROM users WHERE reminder_time = ?", (reminder_time,))
         users = cursor.fetchall()
         conn.close()
         
         if not users:
-            print("📭 Нет зарегистрированных пользователей")
+            if reminder_time is None:
+                logger.info("📭 Нет зарегистрированных пользователей")
             return
         
-        success_count = 0
+        logger.info("⏰ Корзина напоминаний %s: %s пользователей", reminder_time or 'все', len(users))
+        
+        reminded_ids = []
         
         for user_id, name, username in users:
             if is_user_absent_today(user_id, tomorrow):
-                print(f"⏭️ Пропускаем пользователя {name} (ID: {user_id}) — в отпуске завтра")
+                logger.info(
+                    "⏭️ Пропускаем пользователя %s — в отпуске завтра", name,
+                    extra={"user_id": user_id, "sampled": True}
+                )
                 continue
-                
+            
             try:
-                username_display = f" (@{username})" if username else ""
-                message_text = (
-                    f"🌙 Вечернее напоминание\n\n"
-                    f"{name}{username_display}, будешь завтра ({day_name}) на парах?\n\n"
-                    f"📅 Завтра: {tomorrow}"
+                message_text = build_reminder_text(name, username, day_name, tomorrow)
+                await bot.send_message(user_id, message_text, reply_markup=get_reminder_kb(tomorrow))
+                reminded_ids.append(user_id)
+                await asyncio.sleep(0.05)
+            
+            except (TelegramForbiddenError, TelegramAPIError):
+                continue
+        
+        if reminded_ids:
+            conn = connect_db()
+            cursor = conn.cursor()
+            cursor.executemany(
+                "INSERT OR IGNORE INTO reminder_log (user_id, target_date) VALUES (?, ?)",
+                [(user_id, tomorrow) for user_id in reminded_ids]
+            )
+            conn.commit()
+            conn.close()
+        
+        logger.info(
+            "✅ Напоминание отправлено %s пользователям", len(reminded_ids),
+            extra={"handler": "send_daily_reminder", "duration_ms": round((time.perf_counter() - started) * 1000, 1)}
+        )
+        
+    except Exception as e:
+        logger.exception("❌ Ошибка напоминания: %s", e)
+
+def get_non_responders(target_date: str, reminder_time: str) -> list:
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT user_id, name, username FROM users
+        WHERE user_id IN (
+            SELECT r.user_id FROM reminder_log r
+            JOIN users u ON u.user_id = r.user_id
+            WHERE r.target_date = ? AND r.followup_sent_at IS NULL AND u.reminder_time = ?
+            EXCEPT
+            SELECT user_id FROM marks WHERE date = ?
+            EXCEPT
+            SELECT user_id FROM absence_periods
+            WHERE ? BETWEEN {sql_iso_date('start_date')} AND {sql_iso_date('end_date')}
+        )
+    """, (target_date, reminder_time, target_date, to_iso_key(target_date)))
+    users = cursor.fetchall()
+    conn.close()
+    return users
+
+async def send_followup_reminder(bot: Bot, reminder_moment: datetime):
+    try:
+        reminder_time = reminder_moment.strftime("%H:%M")
+        target_date = (reminder_moment + timedelta(days=1)).strftime("%d.%m.%Y")
+        users = get_non_responders(target_date, reminder_time)
+        if not users:
+            return
+        
+        nudged_ids = []
+        for user_id, name, username in users:
+            try:
+                await bot.send_message(
+                    user_id,
+                    f"🔔 {name}, ты ещё не ответил, будешь ли на парах {target_date}.\n\nОтметься одной кнопкой 👇",
+                    reply_markup=get_reminder_kb(target_date)
                 )
-                
-                await bot.send_message(user_id, message_text, reply_markup=get_main_kb())
-                success_count += 1
+                nudged_ids.append(user_id)
                 await asyncio.sleep(0.05)
-                
             except (TelegramForbiddenError, TelegramAPIError):
                 continue
         
-        print(f"✅ Напоминание отправлено {success_count} пользователям")
+        conn = connect_db()
+        cursor = conn.cursor()
+        cursor.executemany(
+            "UPDATE reminder_log SET followup_sent_at = CURRENT_TIMESTAMP WHERE user_id = ? AND target_date = ?",
+            [(user_id, target_date) for user_id, _, _ in users]
+        )
+        conn.commit()
+        conn.close()
         
+        logger.info("🔔 Повторное напоминание (%s, %s): %s из %s не ответивших", reminder_time, target_date, len(nudged_ids), len(users))
+    
     except Exception as e:
-        print(f"❌ Ошибка напоминания: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Ошибка повторного напоминания: %s", e)
+
+def is_followup_allowed(now: datetime, reminder_moment: datetime) -> bool:
+    return now.date() == reminder_moment.date() and now.strftime("%H:%M") <= FOLLOWUP_LATEST
+
+async def send_group_reminders(bot: Bot, now: datetime):
+    await send_daily_reminder(bot, now.strftime("%H:%M"))
+    reminder_moment = now - timedelta(minutes=FOLLOWUP_DELAY_MINUTES)
+    if FOLLOWUP_DELAY_MINUTES > 0 and is_followup_allowed(now, reminder_moment):
+        await send_followup_reminder(bot, reminder_moment)
+
+async def dispatch_reminder_bucket(bot: Bot):
+    now = datetime.now(TIMEZONE)
+    for group in group_registry.all():
+        with group_context(group):
+            task_queue.submit("notifications", send_group_reminders, bot, now)
+
+async def schedule_db_maintenance():
+    for group in group_registry.all():
+        with group_context(group):
+            task_queue.submit("maintenance", run_db_maintenance, key=f"db_maintenance:{group.group_id}")
+
+async def schedule_journal_maintenance():
+    for group in group_registry.all():
+        with group_context(group):
+            task_queue.submit("maintenance", extend_journal, key=f"extend_journal:{group.group_id}", supersede=True)
+
+async def flush_admin_digests():
+    for group in group_registry.all():
+        await group.digest.flush()
+
+def init_group_storage():
+    init_db()
+    init_event_log()
+    school_calendar.load_holidays()
+    attendance_matrix.load()
+    extend_journal()
 
 async def main():
-    print(f"🔧 Админский ID: {ADMIN_CHAT_ID}")
-    print(f"🤖 Запуск бота...")
+    logger.info("🔧 Админский ID: %s", ADMIN_CHAT_ID)
+    logger.info("🤖 Запуск бота...")
     
-    init_db()
-    if not os.path.exists(EXCEL_FILE):
-        init_excel()
-    else:
-        wb = load_workbook(EXCEL_FILE)
-        ws = wb.active
-        ensure_dates_in_excel(ws, datetime.now(), 30)
-        wb.save(EXCEL_FILE)
+    group_registry.load()
+    for group in group_registry.all():
+        with group_context(group):
+            init_group_storage()
     
+    throttling = ThrottlingMiddleware()
+    dp.message.outer_middleware(throttling)
+    dp.callback_query.outer_middleware(throttling)
+    dp.message.outer_middleware(GroupMiddleware())
+    dp.callback_query.outer_middleware(GroupMiddleware())
+    router.message.middleware(LoggingMiddleware())
+    router.callback_query.middleware(LoggingMiddleware())
     dp.include_router(router)
     await bot.set_my_commands([
         {"command": "start", "description": "Начать диалог"},
         {"command": "rename", "description": "Изменить имя"},
+        {"command": "remind", "description": "Время напоминания"},
         {"command": "history", "description": "История отсутствий"},
         {"command": "absence", "description": "Периоды отсутствия"},
         {"command": "clear_absence", "description": "Удалить периоды"},
         {"command": "duty", "description": "Назначить дежурных (админ)"},
+        {"command": "find", "description": "Найти студента (админ)"},
+        {"command": "join", "description": "Перейти в группу по коду"},
         {"command": "help", "description": "Помощь"},
         {"command": "journal", "description": "Получить журнал (админ)"},
         {"command": "support", "description": "Поддержать разработчика ❤️"},
     ])
     
-    scheduler = AsyncIOScheduler(timezone=ZoneInfo("Europe/Moscow"))
+    scheduler = AsyncIOScheduler(timezone=TIMEZONE)
     scheduler.add_job(
-        send_daily_reminder,
-        CronTrigger(hour=20, minute=0, timezone=ZoneInfo("Europe/Moscow")),
+        dispatch_reminder_bucket,
+        CronTrigger(minute="*", timezone=TIMEZONE),
         args=[bot],
         id="evening_reminder",
         replace_existing=True,
-        misfire_grace_time=1800
+        misfire_grace_time=50,
+        coalesce=True
     )
+    maintenance_hour, maintenance_minute = JOURNAL_MAINTENANCE_TIME.split(":")
+    scheduler.add_job(
+        schedule_journal_maintenance,
+        CronTrigger(hour=int(maintenance_hour), minute=int(maintenance_minute), timezone=TIMEZONE),
+        id="journal_maintenance",
+        replace_existing=True,
+        coalesce=True
+    )
+    db_maintenance_hour, db_maintenance_minute = DB_MAINTENANCE_TIME.split(":")
+    scheduler.add_job(
+        schedule_db_maintenance,
+        CronTrigger(hour=int(db_maintenance_hour), minute=int(db_maintenance_minute), timezone=TIMEZONE),
+        id="db_maintenance",
+        replace_existing=True,
+        coalesce=True
+    )
+    if DIGEST_INTERVAL_MINUTES > 0:
+        scheduler.add_job(
+            flush_admin_digests,
+            IntervalTrigger(minutes=DIGEST_INTERVAL_MINUTES),
+            id="admin_digest",
+            replace_existing=True,
+            coalesce=True
+        )
     scheduler.start()
-    print("⏰ Планировщик запущен: напоминание в 20:00 по МСК")
-    print("📅 Учтены учебные дни: понедельник-суббота")
-    print(f"📊 Excel-журнал: {os.path.abspath(EXCEL_FILE)}")
+    logger.info("⏰ Планировщик запущен: напоминания по корзинам времени (по умолчанию %s МСК)", DEFAULT_REMINDER_TIME)
+    logger.info("📅 Учтены учебные дни: понедельник-суббота, праздников и каникул: %s", len(school_calendar.holidays))
+    logger.info("📊 Excel-журнал: %s, групп: %s", os.path.abspath(journal_file()), len(group_registry.groups))
     
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await flush_admin_digests()
 
 if __name__ == "__main__":
+    log_listener = setup_logging()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
-        print("\n👋 Бот остановлен.")
+        logger.info("👋 Бот остановлен.")
     except Exception as e:
-        print(f"❌ Ошибка: {e}")
-        import traceback
-        traceback.print_exc()
\ No newline at end of file
+        logger.exception("❌ Ошибка: %s", e)
+    finally:
+        log_listener.stop()
\ No newline at end of file